@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the ebook download write path.
+Serves a generated file from a local http server and compares the throughput of the former download loop
+(1 KiB chunks, a flush and a progress bar redraw per chunk) with utils.downloader.download_file.
+
+    python benchmarks/bench_download_writer.py --size 256 --repeat 3
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:  # python 2
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+from utils.downloader import download_file  # noqa: E402
+
+BENCH_FILE_NAME = 'book.pdf'
+
+
+class QuietFileRequestHandler(SimpleHTTPRequestHandler):
+    """Serves the files from the current working directory without logging every request"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_file_server(folder_path):
+    os.chdir(folder_path)
+    server = HTTPServer(('127.0.0.1', 0), QuietFileRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def render_progress_bar(stream, current_work_done):
+    """Same rendering as PacktPublishingFreeEbook.update_download_progress_bar, written into the given stream"""
+    bar = '#' * int(current_work_done * 50)
+    stream.write("\r[PROGRESS] - [{0:50s}] {1:.1f}% ".format(bar, current_work_done * 100))
+
+
+def legacy_download(session, url, file_path, progress_stream):
+    r = session.get(url, timeout=100, stream=True)
+    with open(file_path, 'wb') as f:
+        total_length = int(r.headers.get('content-length'))
+        num_of_chunks = (total_length / 1024) + 1
+        for num, chunk in enumerate(r.iter_content(chunk_size=1024)):
+            if chunk:
+                render_progress_bar(progress_stream, num / num_of_chunks)
+                f.write(chunk)
+                f.flush()
+
+
+def writer_download(session, url, file_path, progress_stream):
+    download_file(session, url, file_path, progress_callback=lambda done: render_progress_bar(progress_stream, done))
+
+
+def measure(download, session, url, target_folder, size_bytes, repeat):
+    """Returns the best throughput in MB/s out of `repeat` runs"""
+    best = 0.0
+    for i in range(repeat):
+        file_path = os.path.join(target_folder, 'download_{}.pdf'.format(i))
+        progress_stream = io.StringIO()
+        start_time = time.time()
+        download(session, url, file_path, progress_stream)
+        elapsed = time.time() - start_time
+        if os.path.getsize(file_path) != size_bytes:
+            raise RuntimeError("Downloaded file '{}' is incomplete".format(file_path))
+        os.remove(file_path)
+        best = max(best, size_bytes / elapsed / 1024 ** 2)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", help="size of the served file in MiB", type=int, default=128)
+    parser.add_argument("--repeat", help="number of downloads per variant, the best one is reported", type=int,
+                        default=3)
+    args = parser.parse_args()
+
+    serve_folder = tempfile.mkdtemp()
+    target_folder = tempfile.mkdtemp()
+    size_bytes = args.size * 1024 ** 2
+    try:
+        with open(os.path.join(serve_folder, BENCH_FILE_NAME), 'wb') as f:
+            for _ in range(args.size):
+                f.write(os.urandom(1024 ** 2))
+        server = start_file_server(serve_folder)
+        url = 'http://127.0.0.1:{}/{}'.format(server.server_address[1], BENCH_FILE_NAME)
+        session = requests.Session()
+        legacy = measure(legacy_download, session, url, target_folder, size_bytes, args.repeat)
+        writer = measure(writer_download, session, url, target_folder, size_bytes, args.repeat)
+        server.shutdown()
+    finally:
+        shutil.rmtree(serve_folder, ignore_errors=True)
+        shutil.rmtree(target_folder, ignore_errors=True)
+
+    print("file size:         {} MiB".format(args.size))
+    print("1 KiB chunk loop:  {:8.1f} MB/s".format(legacy))
+    print("DownloadWriter:    {:8.1f} MB/s".format(writer))
+    print("speedup:           {:8.2f}x".format(writer / legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+Local stand-in of packtpub.com and api.anti-captcha.com used to benchmark the script offline.
+It serves pages shaped like the recorded login, free-learning, my-ebooks and book pages, a my-ebooks library of
+N synthetic books and binary downloads, all with a configurable latency and bandwidth.
+
+    python benchmarks/packt_stand_in.py --port 8000 --books 500 --latency 50 --bandwidth 2048
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+FORM_BUILD_ID = 'form-stand-in-build-id'
+RECAPTCHA_WEBSITE_KEY = '6LeAHSgUAAAAAKsn5jo6RUSTLVxGNYyuvUcLMe0_'
+SESSION_COOKIE = 'SESS_stand_in=logged-in'
+DAILY_BOOK_TITLE = 'Mastering Offline Benchmarks'
+DAILY_BOOK_NID = 0
+
+# ~40 KB of navigation markup, like the real pages carry around the parts the script reads
+PAGE_HEADER = ('<!DOCTYPE html><html><head><title>Packt</title>'
+               '<script>var Packt = Packt || {}; Packt.offers = {};</script></head><body>'
+               '<div id="menuBarWrapper"><ul class="menu">' +
+               ''.join('<li class="menu-item leaf"><a href="/category/{0}" class="menu-link">Category {0}</a>'
+                       '<span class="menu-count">{0}</span></li>'.format(i) for i in range(400)) +
+               '</ul></div><div id="page" class="cf">')
+PAGE_FOOTER = ('</div><div id="footer" class="cf">' +
+               ''.join('<p class="footer-link"><a href="/about/{0}">About {0}</a></p>'.format(i) for i in range(200)) +
+               '</div></body></html>')
+
+LOGIN_PAGE = (PAGE_HEADER +
+              '<div class="register-page-form"><form id="packt-user-login-form" class="login-form cf" method="post">'
+              '<input type="text" name="email"/><input type="password" name="password"/>'
+              '<input type="hidden" name="form_build_id" value="' + FORM_BUILD_ID + '"/>'
+              '<input type="hidden" name="form_id" value="packt_user_login_form"/></form></div>' + PAGE_FOOTER)
+
+FREE_LEARNING_PAGE = (PAGE_HEADER +
+                      '<script>Packt.offers.onLoadRecaptcha(\'' + RECAPTCHA_WEBSITE_KEY + '\');</script>'
+                      '<div id="deal-of-the-day" class="cf"><div class="dotd-main-book cf">'
+                      '<div class="dotd-main-book-image float-left"><a href="/application-development/daily-book">'
+                      '<img src="/images/daily-book.png" class="bookimage imagecache"/></a></div>'
+                      '<div class="dotd-main-book-summary float-left"><div class="dotd-title"><h2>\n\t\t\t' +
+                      DAILY_BOOK_TITLE + '\t\t</h2></div><div>Today\'s free ebook.</div>'
+                      '<div class="free-ebook"><form action="/freelearning-claim/{nid}/21478" method="post">'
+                      '<input type="submit" class="form-submit" value="Claim Your Free eBook"/></form></div>'
+                      '<div class="dotd-main-book-form cf"><a class="twelve-days-claim">Claim</a></div>'
+                      '</div></div></div>'.format(nid=DAILY_BOOK_NID) + PAGE_FOOTER)
+
+BOOK_PAGE = (PAGE_HEADER +
+             '<div class="book-top-block-wrapper cf"><div class="book-top-block-info cf">'
+             '<div class="book-top-block-info-title float-left"><h1>' + DAILY_BOOK_TITLE + '</h1></div>'
+             '<div class="book-top-block-info-authors">\n\t\tJane Doe\n\t\tJohn Doe</div>'
+             '<div class="book-top-block-info-one-liner cf">Measure the hot paths without hitting the website.</div>'
+             '<div class="book-top-block-info-published"><time datetime="2017-10-01">October 2017</time></div></div>'
+             '<div class="book-top-block-code float-left"><a href="/code_download/{nid}">Code Files</a></div>'
+             '</div>'.format(nid=DAILY_BOOK_NID) + PAGE_FOOTER)
+
+CLAIMED_PAGE = PAGE_HEADER + '<h1>My eBooks</h1>' + PAGE_FOOTER
+
+PRODUCT_LINE = ('<div class="product-line unseen" nid="{nid}" title="{title}">'
+                '<div class="product-thumbnail"><img src="/images/{nid}.png" class="imagecache"/></div>'
+                '<div class="product-info"><div class="title">{title} [eBook]</div>'
+                '<div class="author">Author {nid}</div></div>'
+                '<div class="product-buttons-line toggle"><div class="download-container cf">'
+                '<a href="/ebook_download/{nid}/pdf"><div class="fake-button">PDF</div></a>'
+                '<a href="/ebook_download/{nid}/epub"><div class="fake-button">ePub</div></a>'
+                '<a href="/ebook_download/{nid}/mobi"><div class="fake-button">Mobi</div></a>'
+                '<a href="/code_download/{nid}"><div class="fake-button">Code</div></a>'
+                '</div></div></div>')
+
+DOWNLOAD_PATH_PATTERN = re.compile(r'^/(?:ebook_download/(\d+)/(\w+)|code_download/(\d+))$')
+WRITE_BLOCK_SIZE = 64 * 1024
+
+
+def synthetic_book_title(nid):
+    return DAILY_BOOK_TITLE if nid == DAILY_BOOK_NID else 'Synthetic Book {} Cookbook'.format(nid)
+
+
+class PacktStandInServer(ThreadingMixIn, HTTPServer):
+    """Threaded http server holding the stand-in settings and the traffic statistics"""
+    daemon_threads = True
+
+    def __init__(self, address, books=100, file_size=1024 ** 2, latency_sec=0.0, bandwidth=None,
+                 captcha_solve_time_sec=0.0):
+        """
+        :param books: number of books on my-ebooks page
+        :param file_size: size in bytes of every downloaded file
+        :param latency_sec: delay added before every response
+        :param bandwidth: max bytes/s per response, unlimited if None
+        :param captcha_solve_time_sec: time after which an anti-captcha task gets solved
+        """
+        HTTPServer.__init__(self, address, PacktStandInRequestHandler)
+        self.books = books
+        self.file_size = file_size
+        self.latency_sec = latency_sec
+        self.bandwidth = bandwidth
+        self.captcha_solve_time_sec = captcha_solve_time_sec
+        self.my_books_page = (PAGE_HEADER +
+                              ''.join(PRODUCT_LINE.format(nid=nid, title=synthetic_book_title(nid))
+                                      for nid in range(books)) + PAGE_FOOTER)
+        self.my_books_etag = '"{}"'.format(hashlib.md5(self.my_books_page.encode('utf-8')).hexdigest())
+        self.captcha_tasks = {}
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def handle_error(self, request, client_address):
+        pass  # clients closing their keep-alive connections aren't worth a traceback
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'bytes_sent': 0}
+
+    def record(self, bytes_sent=0, requests=0):
+        with self.lock:
+            self.stats['requests'] += requests
+            self.stats['bytes_sent'] += bytes_sent
+
+    def file_content(self, path):
+        """Deterministic content of a downloaded file, so resumed downloads stay consistent"""
+        block = hashlib.sha256(path.encode('utf-8')).digest() * (WRITE_BLOCK_SIZE // 32)
+        return (block * (self.file_size // len(block) + 1))[:self.file_size]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+class PacktStandInRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def __is_logged_in(self):
+        return SESSION_COOKIE in (self.headers.get('Cookie') or '')
+
+    def __send(self, body, status=200, headers=None, content_type='text/html; charset=utf-8'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        bandwidth = self.server.bandwidth
+        for start in range(0, len(body), WRITE_BLOCK_SIZE):
+            block = body[start:start + WRITE_BLOCK_SIZE]
+            self.wfile.write(block)
+            self.server.record(bytes_sent=len(block))
+            if bandwidth:
+                time.sleep(len(block) / float(bandwidth))
+
+    def __read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def __begin(self):
+        self.server.record(requests=1)
+        if self.server.latency_sec:
+            time.sleep(self.server.latency_sec)
+
+    def do_GET(self):
+        self.__begin()
+        path = self.path.split('?')[0]
+        if path == '/register':
+            return self.__send(LOGIN_PAGE)
+        if path == '/account/my-ebooks':
+            if not self.__is_logged_in():
+                return self.__send(LOGIN_PAGE)
+            if self.headers.get('If-None-Match') == self.server.my_books_etag:
+                return self.__send(b'', status=304, headers={'ETag': self.server.my_books_etag})
+            return self.__send(self.server.my_books_page, headers={'ETag': self.server.my_books_etag})
+        if path == '/packt/offers/free-learning':
+            return self.__send(FREE_LEARNING_PAGE)
+        if path == '/application-development/daily-book':
+            return self.__send(BOOK_PAGE)
+        match = DOWNLOAD_PATH_PATTERN.match(path)
+        if match and self.__is_logged_in():
+            return self.__send_file(path)
+        self.__send('Not found', status=404)
+
+    do_HEAD = do_GET
+
+    def __send_file(self, path):
+        content = self.server.file_content(path)
+        range_match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if range_match is None:
+            return self.__send(content, content_type='application/octet-stream')
+        first_byte = int(range_match.group(1))
+        if first_byte >= len(content):
+            return self.__send(b'', status=416, headers={'Content-Range': 'bytes */{}'.format(len(content))})
+        self.__send(content[first_byte:], status=206, content_type='application/octet-stream',
+                    headers={'Content-Range': 'bytes {}-{}/{}'.format(first_byte, len(content) - 1, len(content))})
+
+    def do_POST(self):
+        self.__begin()
+        body = self.__read_body()
+        path = self.path.split('?')[0]
+        if path == '/register':
+            return self.__send(CLAIMED_PAGE, headers={'Set-Cookie': SESSION_COOKIE + '; Path=/'})
+        if path.startswith('/freelearning-claim/'):
+            if self.__is_logged_in() and b'g-recaptcha-response=' in body:
+                return self.__send(CLAIMED_PAGE)
+            return self.__send(LOGIN_PAGE, status=403)
+        if path in ('/createTask', '/getTaskResult'):
+            return self.__send(json.dumps(self.__anticaptcha(path, json.loads(body.decode('utf-8')))),
+                               content_type='application/json')
+        self.__send('Not found', status=404)
+
+    def __anticaptcha(self, path, content):
+        with self.server.lock:
+            if path == '/createTask':
+                task_id = len(self.server.captcha_tasks) + 1
+                self.server.captcha_tasks[task_id] = time.time()
+                return {'errorId': 0, 'taskId': task_id}
+            created_at = self.server.captcha_tasks.get(content.get('taskId'))
+        if created_at is None:
+            return {'errorId': 16, 'errorCode': 'ERROR_NO_SUCH_CAPCHA_ID', 'errorDescription': 'Task not found'}
+        if time.time() - created_at < self.server.captcha_solve_time_sec:
+            return {'errorId': 0, 'status': 'processing'}
+        return {'errorId': 0, 'status': 'ready', 'solution': {'gRecaptchaResponse': 'stand-in-solution'}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--books", help="number of books in the library", type=int, default=100)
+    parser.add_argument("--file_size", help="size of every downloaded file in KiB", type=int, default=1024)
+    parser.add_argument("--latency", help="latency added to every response in ms", type=float, default=0)
+    parser.add_argument("--bandwidth", help="bandwidth per response in KiB/s, unlimited by default", type=float)
+    parser.add_argument("--captcha_time", help="time needed to solve a captcha in seconds", type=float, default=0)
+    args = parser.parse_args()
+    server = PacktStandInServer(('127.0.0.1', args.port), args.books, args.file_size * 1024, args.latency / 1000.0,
+                                args.bandwidth * 1024 if args.bandwidth else None, args.captcha_time)
+    print("Packt stand-in listening on {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
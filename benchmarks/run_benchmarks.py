@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Offline end-to-end benchmark of packtPublishingFreeEbook.py against the local Packt stand-in.
+The scenarios run one after another in separate processes sharing the same config folder, like consecutive cron
+runs would (so the later ones benefit from the stored session and library index):
+  grab          - PacktPublishingFreeEbook.grab_ebook() with a cold start (login + captcha + claim)
+  download_all  - PacktPublishingFreeEbook.download_books() of the whole library
+  download_one  - PacktPublishingFreeEbook.download_books() of the daily title into an empty folder
+  cli           - `packtPublishingFreeEbook.py -gd` entry point
+
+For each of them the wall time, the number of requests received by the stand-in, bytes/s sent by it and the peak
+RSS of the process are reported.
+
+    python benchmarks/run_benchmarks.py --books 300 --file_size 256 --latency 30 --workers 4 --json results.json
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import json
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+SRC_PATH = os.path.join(BENCHMARKS_PATH, os.pardir, 'src')
+SCRIPT_PATH = os.path.join(SRC_PATH, 'packtPublishingFreeEbook.py')
+SCENARIOS = ('grab', 'download_all', 'download_one', 'cli')
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+CONFIG_TEMPLATE = """[LOGIN_DATA]
+email: benchmark@example.com
+password: benchmark
+
+[DOWNLOAD_DATA]
+download_folder_path: {download_folder_path}
+download_formats: pdf, epub, mobi, code
+ebook_extra_info_log_file_path: eBookMetadata.log
+download_workers: {workers}
+
+[ANTICAPTCHA_DATA]
+key: benchmark
+api_url: {url}
+initial_delay: {captcha_time}
+
+[PACKTPUB_DATA]
+url: {url}
+"""
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss  # bytes on macOS, KiB elsewhere
+
+
+def empty_folder(folder_path):
+    shutil.rmtree(folder_path)
+    os.mkdir(folder_path)
+
+
+def run_scenario(scenario, cfg_file_path):
+    """Runs a single scenario in the current process and prints its measurements"""
+    sys.path.insert(0, SRC_PATH)
+    from packtPublishingFreeEbook import ConfigurationModel, PacktPublishingFreeEbook
+    from packt_stand_in import DAILY_BOOK_TITLE
+    cfg = ConfigurationModel(cfg_file_path)
+    succeeded = True
+    start_time = time.time()
+    if scenario == 'grab':
+        PacktPublishingFreeEbook(cfg).grab_ebook()
+    elif scenario == 'download_all':
+        PacktPublishingFreeEbook(cfg).download_books()
+    elif scenario == 'download_one':
+        empty_folder(cfg.download_folder_path)
+        start_time = time.time()
+        PacktPublishingFreeEbook(cfg).download_books([DAILY_BOOK_TITLE])
+    elif scenario == 'cli':
+        empty_folder(cfg.download_folder_path)
+        start_time = time.time()
+        sys.argv = [SCRIPT_PATH, '-gd', '-c', cfg_file_path]
+        try:
+            runpy.run_path(SCRIPT_PATH, run_name='__main__')
+        except SystemExit as e:
+            succeeded = not e.code
+    wall_time = time.time() - start_time
+    print(RESULT_PREFIX + json.dumps({'wall_time': wall_time, 'peak_rss_kb': peak_rss_kb(), 'succeeded': succeeded}))
+
+
+def launch_scenario(scenario, cfg_file_path, work_folder_path):
+    """Runs a scenario in a child process and returns its measurements"""
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--run_scenario', scenario,
+                                      '--cfg', cfg_file_path], cwd=work_folder_path, stderr=subprocess.STDOUT)
+    for line in output.decode('utf-8', 'replace').splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError("Scenario '{}' failed:\n{}".format(scenario, output.decode('utf-8', 'replace')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", help="number of books in the library", type=int, default=100)
+    parser.add_argument("--file_size", help="size of every downloaded file in KiB", type=int, default=256)
+    parser.add_argument("--latency", help="latency added to every response in ms", type=float, default=20)
+    parser.add_argument("--bandwidth", help="bandwidth per response in KiB/s, unlimited by default", type=float)
+    parser.add_argument("--captcha_time", help="time needed to solve a captcha in seconds", type=float, default=0)
+    parser.add_argument("--workers", help="download_workers set in the config file", type=int, default=1)
+    parser.add_argument("--scenarios", help="scenarios to run", nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--json", help="file the results are written to as json")
+    parser.add_argument("--run_scenario", help=argparse.SUPPRESS, choices=SCENARIOS)
+    parser.add_argument("--cfg", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sys.path.insert(0, BENCHMARKS_PATH)
+    if args.run_scenario:
+        return run_scenario(args.run_scenario, args.cfg)
+
+    from packt_stand_in import PacktStandInServer
+    server = PacktStandInServer(('127.0.0.1', 0), args.books, args.file_size * 1024, args.latency / 1000.0,
+                                args.bandwidth * 1024 if args.bandwidth else None, args.captcha_time).start()
+    work_folder_path = tempfile.mkdtemp()
+    results = []
+    try:
+        download_folder_path = os.path.join(work_folder_path, 'ebooks')
+        os.mkdir(download_folder_path)
+        cfg_file_path = os.path.join(work_folder_path, 'configFile.cfg')
+        with open(cfg_file_path, 'w') as f:
+            f.write(CONFIG_TEMPLATE.format(download_folder_path=download_folder_path, workers=args.workers,
+                                           url=server.url, captcha_time=args.captcha_time))
+        for scenario in args.scenarios:
+            server.reset_stats()
+            result = launch_scenario(scenario, cfg_file_path, work_folder_path)
+            result.update(server.stats)
+            result['scenario'] = scenario
+            result['bytes_per_sec'] = result['bytes_sent'] / result['wall_time'] if result['wall_time'] else 0
+            results.append(result)
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_folder_path, ignore_errors=True)
+
+    print("books: {}, file size: {} KiB, latency: {} ms, bandwidth: {}, workers: {}".format(
+        args.books, args.file_size, args.latency,
+        '{} KiB/s'.format(args.bandwidth) if args.bandwidth else 'unlimited', args.workers))
+    print("{:<14}{:>10}{:>10}{:>12}{:>14}{:>8}".format('scenario', 'wall [s]', 'requests', 'MB/s', 'peak RSS [MB]',
+                                                       'ok'))
+    for result in results:
+        print("{:<14}{:>10.2f}{:>10}{:>12.2f}{:>14}{:>8}".format(
+            result['scenario'], result['wall_time'], result['requests'], result['bytes_per_sec'] / 1024 ** 2,
+            '{:.1f}'.format(result['peak_rss_kb'] / 1024.0) if result['peak_rss_kb'] else '-',
+            'yes' if result['succeeded'] else 'NO'))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
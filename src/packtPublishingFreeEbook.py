@@ -6,26 +6,48 @@ import datetime as dt
 import logging
 import os
 import re
+import shutil
 import sys
+import tempfile
+import threading
 import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 import configparser
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 from utils.anticaptcha import Anticaptcha
-from utils.logger import get_logger
+from utils.batch import BATCH_REPORT_FILE_NAME, format_report, run_accounts, write_report
+from utils.daemon import FreeLearningDaemon
+from utils.downloader import download_file, open_download_stream
+from utils.html_parser import (get_book_details, get_free_learning_data, get_login_form_build_id,
+                               get_my_books_data)
+from utils.library_index import LIBRARY_INDEX_FILE_NAME, LibraryIndex
+from utils.logger import configure_logging, get_log_file_path, get_logger
+from utils.metrics import METRICS, METRICS_JSON_FILE_NAME, METRICS_PROMETHEUS_FILE_NAME
+from utils.pipeline import SendPipeline
+from utils.profiling import PhaseProfiler
+from utils.session_cache import SESSION_CACHE_FILE_NAME, SessionCache
+from utils.title_index import TITLE_MATCHING_MODES, BookTitleIndex
 
 logger = get_logger(__name__)
 logging.getLogger("requests").setLevel(logging.WARNING)  # downgrading logging level for requests
 
 DATE_FORMAT = "%Y/%m/%d"
 
+SESSION_PROBE_MAX_BYTES = 64 * 1024
+RECAPTCHA_KEY_FILE_NAME = '.packt_recaptcha_key'
+CAPTCHA_SOLUTION_TTL_SEC = 110  # a recaptcha solution expires 2 minutes after it has been solved
+
 SUCCESS_EMAIL_SUBJECT = "{} New free Packt ebook: \"{}\""
 SUCCESS_EMAIL_BODY = "A new free Packt ebook \"{}\" was successfully grabbed. Enjoy!"
 FAILURE_EMAIL_SUBJECT = "{} Grabbing a new free Packt ebook failed"
 FAILURE_EMAIL_BODY = "Today's free Packt ebook grabbing has failed with exception: {}!\n\nCheck this out!"
 
+PROFILED_PHASES = ('run', 'session', 'grab', 'library', 'download', 'send')
+
 
 class ConfigurationModel(object):
     """Contains all needed urls, passwords and packtpub account data stored in .cfg file"""
@@ -38,15 +60,26 @@ class ConfigurationModel(object):
             raise configparser.Error('{} file not found'.format(self.cfg_file_path))
         self.book_infodata_log_file = self._get_config_ebook_extrainfo_log_filename()
         self.anticaptcha_clientkey = self.configuration.get("ANTICAPTCHA_DATA", 'key')
-        self.packtpub_url = "https://www.packtpub.com"
-        self.my_books_url = "https://www.packtpub.com/account/my-ebooks"
-        self.login_url = "https://www.packtpub.com/register"
-        self.freelearning_url = "https://www.packtpub.com/packt/offers/free-learning"
+        self.anticaptcha_api_url = self.configuration.get("ANTICAPTCHA_DATA", 'api_url', fallback=None)
+        self.anticaptcha_website_key = self.configuration.get("ANTICAPTCHA_DATA", 'website_key', fallback=None)
+        self.anticaptcha_initial_delay_sec = self.configuration.getfloat("ANTICAPTCHA_DATA", 'initial_delay',
+                                                                         fallback=None)
+        self.packtpub_url = self.configuration.get("PACKTPUB_DATA", 'url', fallback="https://www.packtpub.com")
+        self.my_books_url = self.packtpub_url + "/account/my-ebooks"
+        self.login_url = self.packtpub_url + "/register"
+        self.freelearning_url = self.packtpub_url + "/packt/offers/free-learning"
+        self.session_cache_file_path = os.path.join(self.cfg_folder_path, SESSION_CACHE_FILE_NAME)
+        self.library_index_file_path = os.path.join(self.cfg_folder_path, LIBRARY_INDEX_FILE_NAME)
+        self.recaptcha_key_file_path = os.path.join(self.cfg_folder_path, RECAPTCHA_KEY_FILE_NAME)
         self.req_headers = {'Connection': 'keep-alive',
                             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 '
                                           '(KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'}
         self.my_packt_email, self.my_packt_password = self._get_config_login_data()
         self.download_folder_path, self.download_formats, self.download_book_titles = self._get_config_download_data()
+        self.download_title_matching = self._get_config_title_matching()
+        self.download_workers, self.download_connections_per_host = self._get_config_download_concurrency()
+        self.metrics_json_file_path, self.metrics_prometheus_file_path = self._get_config_metrics_file_paths()
+        self.daemon_settings = self._get_config_daemon_data()
         if not os.path.exists(self.download_folder_path):
             message = "Download folder path: '{}' doesn't exist".format(self.download_folder_path)
             logger.error(message)
@@ -77,6 +110,44 @@ class ConfigurationModel(object):
             pass
         return download_path, download_formats, download_book_titles
 
+    def _get_config_title_matching(self):
+        """Gets how download_book_titles are matched with the library titles: 'exact' (default), 'prefix', 'fuzzy'"""
+        title_matching = self.configuration.get("DOWNLOAD_DATA", 'download_title_matching', fallback='exact')
+        if title_matching not in TITLE_MATCHING_MODES:
+            raise ValueError("Incorrect download_title_matching: '{}'. Allowed values are: {}".format(
+                title_matching, ', '.join(TITLE_MATCHING_MODES)))
+        return title_matching
+
+    def _get_config_download_concurrency(self):
+        """Gets the number of concurrent downloads (default 1) and the optional connection limit per host."""
+        workers = self.configuration.getint("DOWNLOAD_DATA", 'download_workers', fallback=1)
+        connections_per_host = self.configuration.getint("DOWNLOAD_DATA", 'download_connections_per_host',
+                                                         fallback=None)
+        if connections_per_host is not None:
+            connections_per_host = max(connections_per_host, 1)
+        return max(workers, 1), connections_per_host
+
+    def _get_config_metrics_file_paths(self):
+        """Gets where the run metrics are written as json and prometheus text, next to the log file by default."""
+        return (self.configuration.get("METRICS", 'json_file_path', fallback=None),
+                self.configuration.get("METRICS", 'prometheus_file_path', fallback=None))
+
+    def _get_config_daemon_data(self):
+        """Gets when and how often the free-learning page is polled in daemon mode."""
+        rotation_time = self.configuration.get("DAEMON", 'rotation_time', fallback='00:00')
+        try:
+            hour, minute = (int(part) for part in rotation_time.split(':'))
+        except ValueError:
+            raise ValueError("Incorrect rotation_time: '{}', expected HH:MM".format(rotation_time))
+        return {
+            'rotation_time': (hour, minute),
+            'poll_lead_sec': self.configuration.getfloat("DAEMON", 'poll_lead_sec', fallback=60),
+            'poll_window_sec': self.configuration.getfloat("DAEMON", 'poll_window_sec', fallback=900),
+            'poll_interval_sec': self.configuration.getfloat("DAEMON", 'poll_interval_sec', fallback=5),
+            'session_refresh_interval_sec': self.configuration.getfloat("DAEMON", 'session_refresh_interval_sec',
+                                                                        fallback=1800),
+        }
+
     @staticmethod
     def convert_book_title_to_valid_string(title):
         """removes all unicodes and chars only valid in pathnames on Linux/Windows OS"""
@@ -85,23 +156,270 @@ class ConfigurationModel(object):
         return None
 
 
-class PacktPublishingFreeEbook(object):
-    """Contains some methods to claim, download or send a free daily ebook"""
+class EbookAccountMixin(object):
+    """
+    Account state and helpers shared by PacktPublishingFreeEbook and AsyncPacktPublishingFreeEbook: the config, the
+    grabbed title, the known reCaptcha website key, the book data with its local library index and the download
+    tasks. None of them sends a request, so they suit both the blocking and the asyncio clients.
+    """
 
     download_formats = ('pdf', 'mobi', 'epub', 'code')
-    session = None
+    page_timeout_sec = 10
+    download_timeout_sec = 100
 
-    def __init__(self, cfg):
+    def __init__(self, cfg, anticaptcha=None, page_timeout_sec=None, download_timeout_sec=None):
+        """
+        :param anticaptcha: Anticaptcha client solving the captchas, e.g. shared by many accounts
+        :param page_timeout_sec: timeout of the page requests, 10 s if None
+        :param download_timeout_sec: timeout of the connection and of every read of the downloads, 100 s if None
+        """
         self.cfg = cfg
+        self.anticaptcha = anticaptcha
+        if page_timeout_sec is not None:
+            self.page_timeout_sec = page_timeout_sec
+        if download_timeout_sec is not None:
+            self.download_timeout_sec = download_timeout_sec
         self.book_title = ""
 
+    def _get_known_website_key(self):
+        """
+        Returns the reCaptcha website key if the previous claim needed a captcha (so the next one likely does too):
+        the key set in config file or the one seen during that claim, None otherwise
+        """
+        if not os.path.isfile(self.cfg.recaptcha_key_file_path):
+            return None
+        if self.cfg.anticaptcha_website_key:
+            return self.cfg.anticaptcha_website_key
+        with open(self.cfg.recaptcha_key_file_path) as f:
+            return f.read().strip() or None
+
+    def _remember_website_key(self, website_key, presolved_website_key):
+        """Stores the website key seen on the page for the next claim, unless it was already known"""
+        if website_key != presolved_website_key or not os.path.isfile(self.cfg.recaptcha_key_file_path):
+            with open(self.cfg.recaptcha_key_file_path, 'w') as f:
+                f.write(website_key)
+
+    def _forget_website_key(self):
+        """The claim hasn't needed a captcha, so the next one isn't solved in advance (anti-captcha tasks are paid)"""
+        if os.path.isfile(self.cfg.recaptcha_key_file_path):
+            os.remove(self.cfg.recaptcha_key_file_path)
+
+    def _write_ebook_infodata(self, data):
+        """
+        Write result to file
+        :param data: the data to be written down
+        """
+        info_book_path = os.path.join(self.cfg.cfg_folder_path, self.cfg.book_infodata_log_file)
+        with open(info_book_path, "a") as output:
+            output.write('\n')
+            for key, value in data.items():
+                output.write('{} --> {}\n'.format(key.upper(), value))
+        logger.info("Complete information for '{}' have been saved".format(data["title"]))
+
+    def _save_ebook_infodata(self, book_details):
+        """
+        :param book_details: details parsed from the book page by get_book_details
+        :return: the data written to the log file
+        """
+        result_data = OrderedDict()
+        result_data["title"] = self.book_title
+        result_data["description"] = book_details['description']
+        result_data["author"] = book_details['author']
+        result_data["date_published"] = book_details['date_published']
+        result_data["code_files_url"] = self.cfg.packtpub_url + book_details['code_files_url']
+        result_data["downloaded_at"] = time.strftime("%d-%m-%Y %H:%M")
+        logger.success("Info data retrieved for '{}'".format(self.book_title))
+        self._write_ebook_infodata(result_data)
+        return result_data
+
+    def _load_book_data(self, book_data):
+        self.book_data = book_data
+        self.title_index = BookTitleIndex(book_data, ConfigurationModel.convert_book_title_to_valid_string)
+
+    def _load_library_index(self, titles, title_matching):
+        """
+        Loads the book data stored in the local library index
+        :return: the LibraryIndex if my-ebooks page needs to be fetched, None if all the given titles are there
+        """
+        library_index = LibraryIndex(self.cfg.library_index_file_path)
+        self._load_book_data(library_index.get_books())
+        if titles is not None and self.book_data and not self.title_index.lookup(titles, title_matching)[1]:
+            logger.info("All requested titles found in the local library index")
+            return None
+        return library_index
+
+    def _get_library_request_headers(self, library_index):
+        """Returns the headers making my-ebooks page request conditional on the library index being outdated"""
+        etag, last_modified = library_index.get_validators() if self.book_data else (None, None)
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def _check_claim_response(self, page_data, status_code, text):
+        """Sets the title of the grabbed ebook, raises RequestException if the claim has failed"""
+        self.book_title = ConfigurationModel.convert_book_title_to_valid_string(page_data['title'])
+        if status_code == 200 and text.find('My eBooks') != -1:
+            logger.success("eBook: '{}' has been successfully grabbed!".format(self.book_title))
+        else:
+            message = "eBook: {} has not been grabbed!, does this promo exist yet? visit the page and check!".format(
+                self.book_title)
+            logger.error(message)
+            raise requests.exceptions.RequestException(message)
+
+    def _get_download_tasks(self, titles, formats, into_folder, title_matching, make_folders=True):
+        """
+        Picks the files of the loaded book data to be downloaded, skipping the files which already exist and the
+        files of books having the same valid title as a book picked before (they would be written to the same path)
+        :param make_folders: creates the folders of the titles with into_folder, unset when nothing is written to disk
+        :return: (list of download tasks, paths of the skipped files)
+        """
+        if formats is None:
+            formats = self.cfg.download_formats
+            if formats is None:
+                formats = self.download_formats
+        if titles is not None:
+            temp_book_data, unmatched_titles = self.title_index.lookup(titles, title_matching)
+            if unmatched_titles and temp_book_data:
+                logger.warning("There is no books with titles: {} at your account!".format(unmatched_titles))
+        else:  # download all
+            temp_book_data = self.book_data
+        if len(temp_book_data) == 0:
+            logger.info("There is no books with provided titles: {} at your account!".format(titles))
+        download_tasks = []
+        existing_file_paths = []
+        task_file_paths = set()
+        for book in temp_book_data:
+            for form in formats:
+                if form in book['download_urls']:
+                    file_type = 'zip' if form == 'code' else form
+                    title = book['valid_title']  # format valid pathname
+                    logger.info("Title: '{}'".format(title))
+                    if into_folder:
+                        target_download_path = os.path.join(self.cfg.download_folder_path, title)
+                        if make_folders and not os.path.isdir(target_download_path):
+                            os.mkdir(target_download_path)
+                    else:
+                        target_download_path = os.path.join(self.cfg.download_folder_path)
+                    full_file_path = os.path.join(target_download_path, "{}.{}".format(title, file_type))
+                    if os.path.isfile(full_file_path):
+                        logger.info("'{}.{}' already exists under the given path".format(title, file_type))
+                        existing_file_paths.append(full_file_path)
+                    elif full_file_path in task_file_paths:
+                        logger.info("'{}.{}' is already downloaded for another book with the same title".format(
+                            title, file_type))
+                    else:
+                        task_file_paths.add(full_file_path)
+                        download_tasks.append({'title': title,
+                                               'form': form,
+                                               'url': self.cfg.packtpub_url + book['download_urls'][form],
+                                               'file_path': full_file_path})
+        return download_tasks, existing_file_paths
+
+    @staticmethod
+    def _log_download_results(download_tasks, nr_of_books_skipped, failed_downloads):
+        nr_of_books_downloaded = len(download_tasks) - len(failed_downloads)
+        logger.info("{} eBooks have been downloaded, {} already existed, {} failed!".format(
+            nr_of_books_downloaded, nr_of_books_skipped, len(failed_downloads)))
+        for task, error in failed_downloads:
+            logger.error("Failed to download '{}': {}".format(os.path.basename(task['file_path']), error))
+
+
+class PacktPublishingFreeEbook(EbookAccountMixin):
+    """Contains some methods to claim, download or send a free daily ebook"""
+
+    session = None
+
+    def __init__(self, cfg, http_adapter=None, anticaptcha=None, page_timeout_sec=None, download_timeout_sec=None):
+        """
+        :param http_adapter: requests transport adapter (connection pool) the session is sent with, e.g. shared by
+                             many accounts, a new one is used by every session if None
+        :param anticaptcha: Anticaptcha client solving the captchas, e.g. shared by many accounts, a new one is
+                            created for every captcha if None
+        :param page_timeout_sec: timeout of the page requests, 10 s if None
+        :param download_timeout_sec: timeout of the connection and of every read of the downloads, 100 s if None
+        """
+        EbookAccountMixin.__init__(self, cfg, anticaptcha=anticaptcha, page_timeout_sec=page_timeout_sec,
+                                   download_timeout_sec=download_timeout_sec)
+        self.http_adapter = http_adapter
+        self.free_learning_validators = {}  # conditional request headers of the last polled free-learning page
+        self._presolved_captcha = (None, None)
+        self._presolved_time = 0
+        self._download_adapter = None  # (adapter, pool size) of the parallel downloads, see __size_connection_pool
+
     def login_required(func, *args, **kwargs):
         def login_decorated(self, *args, **kwargs):
-            if self.session is None:
-                self.__create_http_session()
+            self.__ensure_http_session()
             return func(self, *args, **kwargs)
         return login_decorated
 
+    def __ensure_http_session(self):
+        if self.session is None:
+            with METRICS.phase('session'):
+                if not self.__restore_http_session():
+                    self.__create_http_session()
+
+    def refresh_session(self):
+        """
+        Keeps the session alive with a cheap login probe, logs in again if it has expired
+        :return: True if a new session has been created
+        """
+        if self.session is not None and self.__is_logged_in(self.session):
+            return False
+        logger.info("Session has expired, logging in again...")
+        if self.session is not None:
+            self.session.close()  # and its pooled connections
+        self.session = None
+        self.__ensure_http_session()
+        return True
+
+    def __new_http_session(self):
+        session = requests.Session()
+        session.headers.update(self.cfg.req_headers)
+        session.hooks['response'].append(METRICS.record_response)
+        if self.http_adapter is not None:
+            session.mount('https://', self.http_adapter)
+            session.mount('http://', self.http_adapter)
+        return session
+
+    def __restore_http_session(self):
+        """Reuses the cookies stored by the previous run if they still keep us logged in"""
+        session = self.__new_http_session()
+        session_cache = SessionCache(self.cfg.session_cache_file_path)
+        if not session_cache.load(session):
+            return False
+        if not self.__is_logged_in(session):
+            logger.info("Stored session has expired")
+            session_cache.clear()
+            session.close()
+            return False
+        self.session = session
+        logger.info("Stored session restored, logged in successfully!")
+        return True
+
+    def __is_logged_in(self, session):
+        """Cheap login probe, reads only the beginning of my-ebooks page without following redirects"""
+        try:
+            r = session.get(self.cfg.my_books_url, timeout=self.page_timeout_sec, stream=True, allow_redirects=False)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Session probe failed: {}".format(e))
+            return False
+        try:
+            if r.status_code != 200:
+                return False
+            head = b''
+            for chunk in r.iter_content(chunk_size=8192):
+                head += chunk
+                if b"register-page-form" in head:
+                    return False
+                if len(head) >= SESSION_PROBE_MAX_BYTES:
+                    break
+            return True
+        finally:
+            r.close()
+
     def __create_http_session(self):
         """Creates the http session"""
         form_data = {'email': self.cfg.my_packt_email,
@@ -111,208 +429,299 @@ class PacktPublishingFreeEbook(object):
                      'form_id': 'packt_user_login_form'}
         # to get form_build_id
         logger.info("Creating session...")
-        self.session = requests.Session()
-        self.session.headers.update(self.cfg.req_headers)
-        r = self.session.get(self.cfg.login_url, timeout=10)
-        content = BeautifulSoup(str(r.content), 'html.parser')
-        form_build_id = [element['value'] for element in
-                         content.find(id='packt-user-login-form').find_all('input', {'name': 'form_build_id'})]
-        form_data['form_build_id'] = form_build_id[0]
+        self.session = self.__new_http_session()
+        r = self.session.get(self.cfg.login_url, timeout=self.page_timeout_sec)
+        form_data['form_build_id'] = get_login_form_build_id(r.text)
         self.session.post(self.cfg.login_url, data=form_data)
         # check once again if we are really logged into the server
-        r = self.session.get(self.cfg.my_books_url, timeout=10)
+        r = self.session.get(self.cfg.my_books_url, timeout=self.page_timeout_sec)
         if r.status_code is not 200 or r.text.find("register-page-form") != -1:
             message = "Login failed!"
             logger.error(message)
             raise requests.exceptions.RequestException(message)
         logger.info("Session created, logged in successfully!")
+        SessionCache(self.cfg.session_cache_file_path).save(self.session)
 
-    def __claim_ebook_captchaless(self, url, html):
-        claim_url = html.find(attrs={'class': 'twelve-days-claim'})['href']
-        return self.session.get(self.cfg.packtpub_url + claim_url, timeout=10)
+    def __claim_ebook_captchaless(self, url, page_data):
+        with METRICS.phase('claim'):
+            return self.session.get(self.cfg.packtpub_url + page_data['claim_url'], timeout=self.page_timeout_sec)
 
-    def __claim_ebook_captchafull(self, url, html):
-        key_pattern = re.compile("Packt.offers.onLoadRecaptcha\(\'(.+?)\'\)")
-        website_key = key_pattern.search(html.find(text=key_pattern)).group(1)
-        anticaptcha = Anticaptcha(self.cfg.anticaptcha_clientkey)
-        captcha_solved_id = anticaptcha.solve_recaptcha(url, website_key)
-        claim_url = html.select_one('.free-ebook form')['action']
-        return self.session.post(self.cfg.packtpub_url + claim_url,
-                                 timeout=10,
-                                 data={'g-recaptcha-response': captcha_solved_id})
+    def __new_anticaptcha(self):
+        if self.anticaptcha is not None:
+            return self.anticaptcha
+        return Anticaptcha(self.cfg.anticaptcha_clientkey, self.cfg.anticaptcha_api_url,
+                           initial_delay_sec=self.cfg.anticaptcha_initial_delay_sec)
 
-    def __write_ebook_infodata(self, data):
+    def __presolve_captcha(self, url):
         """
-        Write result to file
-        :param data: the data to be written down
+        Submits the captcha task before logging in and fetching the free-learning page, as the website key rarely
+        changes, so that the solution is ready (or nearly ready) by the time the claim is made.
+        :return: (website_key, future of the solution), both None if the website key isn't known yet
         """
-        info_book_path = os.path.join(self.cfg.cfg_folder_path, self.cfg.book_infodata_log_file)
-        with open(info_book_path, "a") as output:
-            output.write('\n')
-            for key, value in data.items():
-                output.write('{} --> {}\n'.format(key.upper(), value))
-        logger.info("Complete information for '{}' have been saved".format(data["title"]))
+        website_key = self._get_known_website_key()
+        if website_key is None:
+            return None, None
+        logger.info("Solving captcha in the background...")
+        anticaptcha = self.__new_anticaptcha()
+        return website_key, anticaptcha.solve_recaptcha_in_background(url, website_key)
+
+    def presolve_captcha(self):
+        """
+        Starts solving the captcha of the next grab_ebook in the background, e.g. by the daemon just before the offer
+        rotation, as the claim of already polled page data doesn't solve it in advance by itself.
+        Does nothing if a solution is already pending or the website key isn't known yet.
+        """
+        if self._presolved_captcha[1] is not None and time.time() - self._presolved_time < CAPTCHA_SOLUTION_TTL_SEC:
+            return
+        self._presolved_captcha = self.__presolve_captcha(self.cfg.freelearning_url)
+        self._presolved_time = time.time()
+
+    def __take_presolved_captcha(self):
+        presolved_captcha, self._presolved_captcha = self._presolved_captcha, (None, None)
+        if presolved_captcha[1] is not None and time.time() - self._presolved_time >= CAPTCHA_SOLUTION_TTL_SEC:
+            logger.info("The captcha solved in advance has expired")
+            return None, None
+        return presolved_captcha
+
+    def __claim_ebook_captchafull(self, url, page_data, presolved_captcha=(None, None)):
+        presolved_website_key, captcha_solution = presolved_captcha
+        captcha_solved_id = None
+        if captcha_solution is not None and presolved_website_key == page_data['website_key']:
+            try:
+                with METRICS.phase('captcha_wait'):
+                    captcha_solved_id = captcha_solution.result()
+            except Exception as e:
+                logger.warning("Captcha solving in the background failed: {}, retrying...".format(e))
+        if captcha_solved_id is None:
+            anticaptcha = self.__new_anticaptcha()
+            captcha_solved_id = anticaptcha.solve_recaptcha(url, page_data['website_key'])
+            logger.debug("Anticaptcha metrics: {}".format(anticaptcha.metrics))
+        self._remember_website_key(page_data['website_key'], presolved_website_key)
+        claim_url = page_data['claim_form_url']
+        with METRICS.phase('claim'):
+            return self.session.post(self.cfg.packtpub_url + claim_url,
+                                     timeout=self.page_timeout_sec,
+                                     data={'g-recaptcha-response': captcha_solved_id})
 
-    def __get_ebook_infodata(self, r):
+    def __get_ebook_infodata(self, book_url):
         """
         Log grabbed book information to log file
-        :param r: the previous response got when book has been successfully added to user library
+        :param book_url: the book page url found on the free-learning page when the book was grabbed
         :return: the data ready to be written to the log file
         """
         logger.info("Retrieving complete information for '{}'".format(self.book_title))
-        r = self.session.get(self.cfg.freelearning_url, timeout=10)
-        result_html = BeautifulSoup(r.text, 'html.parser')
-        last_grabbed_book = result_html.find('div', {'class': 'dotd-main-book-image'})
-        book_url = last_grabbed_book.find('a').attrs['href']
-        book_page = self.session.get(self.cfg.packtpub_url + book_url, timeout=10).text
-        page = BeautifulSoup(book_page, 'html.parser')
+        book_page = self.session.get(self.cfg.packtpub_url + book_url, timeout=self.page_timeout_sec).text
+        return self._save_ebook_infodata(get_book_details(book_page))
 
-        result_data = OrderedDict()
-        result_data["title"] = self.book_title
-        result_data["description"] = page.find('div', {'class': 'book-top-block-info-one-liner'}).text.strip()
-        author = page.find('div', {'class': 'book-top-block-info-authors'})
-        result_data["author"] = author.text.strip().split("\n")[0]
-        result_data["date_published"] = page.find('time').text
-        code_download_url = page.find('div', {'class': 'book-top-block-code'}).find('a').attrs['href']
-        result_data["code_files_url"] = self.cfg.packtpub_url + code_download_url
-        result_data["downloaded_at"] = time.strftime("%d-%m-%Y %H:%M")
-        logger.success("Info data retrieved for '{}'".format(self.book_title))
-        self.__write_ebook_infodata(result_data)
-        return result_data
+    def __get_my_all_books_data(self, titles=None, title_matching='exact'):
+        """
+        Gets data from all available ebooks.
+        The data comes from the local library index, my-ebooks page is fetched only if some of the given titles
+        are missing there (or no titles are given), with a conditional request which is answered with 304 status
+        when the library hasn't changed.
+        """
+        library_index = self._load_library_index(titles, title_matching)
+        if library_index is None:
+            return
+        with METRICS.phase('library'):
+            self.__fetch_my_all_books_data(library_index)
 
-    def __get_my_all_books_data(self):
-        """Gets data from all available ebooks"""
+    def __fetch_my_all_books_data(self, library_index):
         logger.info("Getting data of all your books...")
-        r = self.session.get(self.cfg.my_books_url, timeout=10)
+        headers = self._get_library_request_headers(library_index)
+        r = self.session.get(self.cfg.my_books_url, timeout=self.page_timeout_sec, headers=headers)
+        if r.status_code == 304:
+            logger.info("Your library hasn't changed, using the local library index")
+            return
         if r.status_code is not 200:
             message = "Cannot open {}, http GET status code != 200".format(self.cfg.my_books_url)
             logger.error(message)
             raise requests.exceptions.RequestException(message)
         logger.info("Opened '{}' successfully!".format(self.cfg.my_books_url))
 
-        self.book_data = []
-        my_books_html = BeautifulSoup(r.text, 'html.parser')
-        all = my_books_html.find_all('div', {'class': 'product-line'})
-        for line in all:
-            if not line.get('nid'):
-                continue
-            title = line.find('div', {'class': 'title'}).getText().strip(' ').replace(' [eBook]', '')
-            download_urls = {}
-            for a in line.find_all('a'):
-                url = a.get('href')
-                for fm in self.download_formats:
-                    if url.find(fm) != -1:
-                        download_urls[fm] = url
-            self.book_data.append({'title': title, 'download_urls': download_urls})
+        with METRICS.phase('parse'):
+            self._load_book_data(get_my_books_data(r.text, self.download_formats))
+        library_index.update(self.book_data, r.headers.get('etag'), r.headers.get('last-modified'))
 
     @login_required
-    def grab_ebook(self, log_ebook_infodata=False):
-        """Grabs the ebook"""
+    def poll_free_learning_page(self):
+        """
+        Fetches the free-learning page with a conditional request, which is answered with 304 status while the page
+        hasn't changed since the previous poll (if the server supports it).
+        :return: the page data as given by get_free_learning_data, None if the page hasn't changed
+        """
+        with METRICS.phase('free_learning'):
+            r = self.session.get(self.cfg.freelearning_url, timeout=self.page_timeout_sec,
+                                 headers=self.free_learning_validators)
+        if r.status_code == 304:
+            return None
+        if r.status_code != 200:
+            raise requests.exceptions.RequestException("http GET status code != 200")
+        self.free_learning_validators = {}
+        if r.headers.get('etag'):
+            self.free_learning_validators['If-None-Match'] = r.headers['etag']
+        if r.headers.get('last-modified'):
+            self.free_learning_validators['If-Modified-Since'] = r.headers['last-modified']
+        with METRICS.phase('parse'):
+            return get_free_learning_data(r.text)
+
+    def grab_ebook(self, log_ebook_infodata=False, page_data=None):
+        """
+        Grabs the ebook
+        :param page_data: free-learning page data, e.g. from poll_free_learning_page, the page is fetched if None
+        """
+        with METRICS.phase('grab'):
+            self.__grab_ebook(log_ebook_infodata, page_data)
+
+    def __grab_ebook(self, log_ebook_infodata, page_data):
         logger.info("Start grabbing eBook...")
         url = self.cfg.freelearning_url
-        r = self.session.get(self.cfg.freelearning_url, timeout=10)
-        if r.status_code is not 200:
-            raise requests.exceptions.RequestException("http GET status code != 200")
-        html = BeautifulSoup(r.text, 'html.parser')
-        if 'href' not in html.find(attrs={'class': 'twelve-days-claim'}):
+        presolved_captcha = self.__take_presolved_captcha()
+        if page_data is None:
+            if presolved_captcha[1] is None:
+                presolved_captcha = self.__presolve_captcha(url)
+            self.__ensure_http_session()
+            with METRICS.phase('free_learning'):
+                r = self.session.get(self.cfg.freelearning_url, timeout=self.page_timeout_sec)
+            if r.status_code is not 200:
+                raise requests.exceptions.RequestException("http GET status code != 200")
+            with METRICS.phase('parse'):
+                page_data = get_free_learning_data(r.text)
+        else:
+            self.__ensure_http_session()
+        if page_data['claim_url'] is None:
             logger.info("Captcha detected. Trying to solve it using anti-captcha.com.")
-            r = self.__claim_ebook_captchafull(url, html)
+            r = self.__claim_ebook_captchafull(url, page_data, presolved_captcha)
         else:
             logger.info("No captcha detected.")
-            r = self.__claim_ebook_captchaless(url, html)
-        self.book_title = ConfigurationModel.convert_book_title_to_valid_string(
-            html.find('div', {'class': 'dotd-title'}).find('h2').next_element)
-        if r.status_code is 200 and r.text.find('My eBooks') != -1:
-            logger.success("eBook: '{}' has been successfully grabbed!".format(self.book_title))
-            if log_ebook_infodata:
-                self.__get_ebook_infodata(r)
-        else:
-            message = "eBook: {} has not been grabbed!, does this promo exist yet? visit the page and check!".format(
-                self.book_title)
-            logger.error(message)
-            raise requests.exceptions.RequestException(message)
+            self._forget_website_key()
+            r = self.__claim_ebook_captchaless(url, page_data)
+        self._check_claim_response(page_data, r.status_code, r.text)
+        if log_ebook_infodata:
+            self.__get_ebook_infodata(page_data['book_url'])
 
     @login_required
-    def download_books(self, titles=None, formats=None, into_folder=False):
+    def download_books(self, titles=None, formats=None, into_folder=False, workers=None, title_matching=None,
+                       on_downloaded=None, stream_to=None):
         """
         Downloads the ebooks.
         :param titles: list('C# tutorial', 'c++ Tutorial') ;
         :param formats: tuple('pdf','mobi','epub','code');
+        :param workers: number of files downloaded concurrently, taken from config file if None
+        :param title_matching: 'exact', 'prefix' or 'fuzzy' titles matching, taken from config file if None
+        :param on_downloaded: called with the path of every requested file as soon as it's on disk, i.e. right away
+                              for the files which already exist and by the downloading thread for the others (but
+                              the streamed ones)
+        :param stream_to: sends the files instead of writing them to disk, e.g. GoogleDriveManager.send_stream, called
+                          by the downloading thread with the path the file would have and a function opening its
+                          download stream, see open_download_stream; returns False if the file hasn't been sent
+        :return: list of (download task, exception) tuples describing the failed downloads
         """
+        if title_matching is None:
+            title_matching = self.cfg.download_title_matching
+        if workers is None:
+            workers = self.cfg.download_workers
         # download ebook
-        self.__get_my_all_books_data()
-        if formats is None:
-            formats = self.cfg.download_formats
-            if formats is None:
-                formats = self.download_formats
-        if titles is not None:
-            temp_book_data = [data for data in self.book_data
-                              if any(ConfigurationModel.convert_book_title_to_valid_string(data['title']) ==
-                                     ConfigurationModel.convert_book_title_to_valid_string(title) for title in
-                                     titles)]
-        else:  # download all
-            temp_book_data = self.book_data
-        if len(temp_book_data) == 0:
-            logger.info("There is no books with provided titles: {} at your account!".format(titles))
-        nr_of_books_downloaded = 0
-        is_interactive = sys.stdout.isatty()
-        for i, book in enumerate(temp_book_data):
-            for form in formats:
-                if form in list(temp_book_data[i]['download_urls'].keys()):
-                    if form == 'code':
-                        file_type = 'zip'
-                    else:
-                        file_type = form
-                    title = ConfigurationModel.convert_book_title_to_valid_string(
-                        temp_book_data[i]['title'])  # format valid pathname
-                    logger.info("Title: '{}'".format(title))
-                    if into_folder:
-                        target_download_path = os.path.join(self.cfg.download_folder_path, title)
-                        if not os.path.isdir(target_download_path):
-                            os.mkdir(target_download_path)
-                    else:
-                        target_download_path = os.path.join(self.cfg.download_folder_path)
-                    full_file_path = os.path.join(target_download_path,
-                                                  "{}.{}".format(title, file_type))
-                    if os.path.isfile(full_file_path):
-                        logger.info("'{}.{}' already exists under the given path".format(title, file_type))
-                    else:
-                        if form == 'code':
-                            logger.info("Downloading code for eBook: '{}'...".format(title))
-                        else:
-                            logger.info("Downloading eBook: '{}' in .{} format...".format(title, form))
-                        try:
-                            r = self.session.get(
-                                self.cfg.packtpub_url + temp_book_data[i]['download_urls'][form],
-                                timeout=100,
-                                stream=True
-                            )
-                            if r.status_code is 200:
-                                with open(full_file_path, 'wb') as f:
-                                    total_length = int(r.headers.get('content-length'))
-                                    num_of_chunks = (total_length / 1024) + 1
-                                    for num, chunk in enumerate(r.iter_content(chunk_size=1024)):
-                                        if chunk:
-                                            if is_interactive:
-                                                PacktPublishingFreeEbook.update_download_progress_bar(
-                                                    num / num_of_chunks
-                                                )
-                                            f.write(chunk)
-                                            f.flush()
-                                    if is_interactive:
-                                        PacktPublishingFreeEbook.update_download_progress_bar(-1)  # add end of line
-                                if form == 'code':
-                                    logger.success("Code for eBook: '{}' downloaded successfully!".format(title))
-                                else:
-                                    logger.success("eBook: '{}.{}' downloaded successfully!".format(title, form))
-                                nr_of_books_downloaded += 1
-                            else:
-                                message = "Cannot download '{}'".format(title)
-                                logger.error(message)
-                                raise requests.exceptions.RequestException(message)
-                        except Exception as e:
-                            logger.error(e)
-        logger.info("{} eBooks have been downloaded!".format(str(nr_of_books_downloaded)))
+        self.__get_my_all_books_data(titles, title_matching)
+        download_tasks, existing_file_paths = self._get_download_tasks(titles, formats, into_folder, title_matching,
+                                                                       make_folders=stream_to is None)
+        if on_downloaded is not None:
+            for file_path in existing_file_paths:
+                on_downloaded(file_path)
+        with METRICS.phase('download'):
+            failed_downloads = self.__run_downloads(download_tasks, workers, on_downloaded, stream_to)
+        self._log_download_results(download_tasks, len(existing_file_paths), failed_downloads)
+        return failed_downloads
+
+    def __run_downloads(self, download_tasks, workers, on_downloaded=None, stream_to=None):
+        """
+        Downloads all the files described by download_tasks, up to `workers` of them at once
+        :param on_downloaded: called with the path of every downloaded file, see download_books
+        :param stream_to: sends the downloaded files instead of writing them, see download_books
+        :return: list of (task, exception) tuples describing the failed downloads
+        """
+        failed_downloads = []
+        if workers <= 1 or len(download_tasks) <= 1:
+            show_progress = sys.stdout.isatty()
+            for task in download_tasks:
+                try:
+                    self.__download_file(task, show_progress, on_downloaded=on_downloaded, stream_to=stream_to)
+                except Exception as e:
+                    logger.error(e)
+                    failed_downloads.append((task, e))
+            return failed_downloads
+        logger.info("Downloading {} files using {} workers...".format(len(download_tasks), workers))
+        if self.http_adapter is None:  # a shared adapter is sized by its owner
+            self.__size_connection_pool(self.cfg.download_connections_per_host or workers)
+        phases = METRICS.current_phases()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = OrderedDict((executor.submit(self.__download_file, task, False, phases, on_downloaded,
+                                                   stream_to), task)
+                                  for task in download_tasks)
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None:
+                    logger.error(error)
+                    failed_downloads.append((futures[future], error))
+        return failed_downloads
+
+    def __size_connection_pool(self, pool_maxsize):
+        """
+        Caps the connections to a single host at pool_maxsize, the workers wait for a free one if the limit is lower.
+        The session keeps its adapter as long as the size doesn't change, a replaced adapter is closed.
+        """
+        if self._download_adapter is not None:
+            adapter, adapter_pool_maxsize = self._download_adapter
+            if self.session.adapters.get('https://') is adapter and adapter_pool_maxsize == pool_maxsize:
+                return
+        replaced_adapters = set(self.session.adapters.get(prefix) for prefix in ('https://', 'http://'))
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._download_adapter = (adapter, pool_maxsize)
+        for replaced_adapter in replaced_adapters:
+            if replaced_adapter is not None:
+                replaced_adapter.close()
+
+    def __download_file(self, task, show_progress=False, phases=None, on_downloaded=None, stream_to=None):
+        """
+        Downloads a single ebook file described by a download task
+        :param phases: metrics phases of the caller, when run by another thread
+        :param on_downloaded: called with the path of the file once it's downloaded
+        :param stream_to: sends the file instead of writing it, see download_books
+        """
+        if phases is not None:
+            with METRICS.continue_phases(phases):
+                return self.__download_file(task, show_progress, on_downloaded=on_downloaded, stream_to=stream_to)
+        if stream_to is not None:
+            return self.__stream_file(task, stream_to)
+        title = task['title']
+        if task['form'] == 'code':
+            logger.info("Downloading code for eBook: '{}'...".format(title))
+        else:
+            logger.info("Downloading eBook: '{}' in .{} format...".format(title, task['form']))
+        progress_callback = PacktPublishingFreeEbook.update_download_progress_bar if show_progress else None
+        with METRICS.phase('download_file'):
+            download_file(self.session, task['url'], task['file_path'], timeout=self.download_timeout_sec,
+                          progress_callback=progress_callback)
+        if show_progress:
+            PacktPublishingFreeEbook.update_download_progress_bar(-1)  # add end of line
+        if task['form'] == 'code':
+            logger.success("Code for eBook: '{}' downloaded successfully!".format(title))
+        else:
+            logger.success("eBook: '{}.{}' downloaded successfully!".format(title, task['form']))
+        if on_downloaded is not None:
+            on_downloaded(task['file_path'])
+
+    def __stream_file(self, task, stream_to):
+        file_name = os.path.basename(task['file_path'])
+        logger.info("Streaming '{}'...".format(file_name))
+        with METRICS.phase('download_file'):
+            sent = stream_to(task['file_path'], partial(open_download_stream, self.session, task['url'],
+                                                        timeout=self.download_timeout_sec))
+        if sent is False:
+            raise requests.exceptions.RequestException("'{}' couldn't be streamed".format(file_name))
+        logger.success("'{}' streamed successfully!".format(file_name))
 
     @staticmethod
     def update_download_progress_bar(current_work_done):
@@ -325,6 +734,219 @@ class PacktPublishingFreeEbook(object):
             print("")
 
 
+def write_run_metrics(cfg, succeeded):
+    """Writes the metrics of the run as json and as prometheus text, next to the log file unless configured"""
+    log_folder_path = os.path.dirname(get_log_file_path())
+    json_file_path = cfg.metrics_json_file_path if cfg is not None else None
+    prometheus_file_path = cfg.metrics_prometheus_file_path if cfg is not None else None
+    try:
+        METRICS.write_json(json_file_path or os.path.join(log_folder_path, METRICS_JSON_FILE_NAME), succeeded)
+        METRICS.write_prometheus(prometheus_file_path or os.path.join(log_folder_path, METRICS_PROMETHEUS_FILE_NAME),
+                                 succeeded)
+    except (IOError, OSError) as e:
+        logger.warning("Cannot write the run metrics: {}".format(e))
+
+
+def run_tasks(args, cfg, ebook, page_data=None, work_folder_path=None):
+    """
+    Grabs, downloads and sends the ebooks as chosen by the command line arguments
+    :param page_data: free-learning page data the ebook is grabbed with, the page is fetched if None
+    :param work_folder_path: folder the ebooks only sent (not kept) are downloaded to, the current one if None
+    :raises RequestException: if any file couldn't be downloaded or sent, once all the others have been
+    """
+    into_folder = args.folder
+
+    # Grab the newest book
+    if args.grab or args.grabl or args.grabd or args.sgd or args.mail:
+        ebook.grab_ebook(log_ebook_infodata=args.grabl, page_data=page_data)
+
+        # Send email about successful book grab. Do it only when book
+        # isn't going to be emailed as we don't want to send email twice.
+        if args.status_mail and not args.mail:
+            from utils.mail import MailBook
+            mb = MailBook(cfg.cfg_file_path)
+            mb.send_info(
+                subject=SUCCESS_EMAIL_SUBJECT.format(
+                    dt.datetime.now().strftime(DATE_FORMAT),
+                    ebook.book_title
+                ),
+                body=SUCCESS_EMAIL_BODY.format(ebook.book_title)
+            )
+
+    # Download book(s) into proper location, the grabbed book is sent by mail or to google_drive as soon as each of
+    # its files is downloaded, or streamed to google_drive without writing it. A file downloaded only to be sent is
+    # deleted once it's sent, the files downloaded by -gd, -da or -dc are kept
+    if args.grabd or args.dall or args.dchosen or args.sgd or args.mail:
+        pipeline = None
+        stream_to = None
+        existing_file_paths = []
+        only_sent = not (args.grabd or args.dall or args.dchosen)  # the grabbed book is downloaded only to be sent
+        if (args.sgd or args.mail) and only_sent:
+            cfg.download_folder_path = work_folder_path or os.getcwd()
+        if args.sgd and args.stream and only_sent:
+            from utils.google_drive import GoogleDriveManager
+            google_drive = GoogleDriveManager(cfg.cfg_file_path)
+            stream_to = partial(google_drive.send_stream, base_folder_path=cfg.download_folder_path)
+            on_downloaded = existing_file_paths.append  # the files already on disk, the others are streamed
+        elif args.sgd or args.mail:
+            pipeline = new_send_pipeline(args, cfg, remove_sent_files=only_sent)
+
+            def on_downloaded(file_path):
+                if ebook.book_title in os.path.basename(file_path):
+                    pipeline.put(file_path)
+        else:
+            on_downloaded = None
+        try:
+            if args.dall:
+                failed_downloads = ebook.download_books(into_folder=into_folder, workers=args.workers,
+                                                        on_downloaded=on_downloaded)
+            elif args.dchosen:
+                failed_downloads = ebook.download_books(cfg.download_book_titles, into_folder=into_folder,
+                                                        workers=args.workers, on_downloaded=on_downloaded)
+            else:
+                failed_downloads = ebook.download_books([ebook.book_title], into_folder=into_folder,
+                                                        workers=args.workers, on_downloaded=on_downloaded,
+                                                        stream_to=stream_to)
+        except Exception:
+            if pipeline is not None:
+                pipeline.close(raise_errors=False)
+            raise
+        failed_files = []
+        if existing_file_paths:
+            with METRICS.phase('send'):
+                failed_files = google_drive.send_files(existing_file_paths, base_folder_path=cfg.download_folder_path)
+        if pipeline is not None:
+            with METRICS.phase('send'):  # the files left to be sent when all of them are downloaded
+                pipeline.close()
+            failed_files = pipeline.failed_files
+        if failed_downloads or failed_files:
+            raise requests.exceptions.RequestException("{} file(s) couldn't be downloaded, {} couldn't be sent".format(
+                len(failed_downloads), len(failed_files)))
+
+
+def new_send_pipeline(args, cfg, remove_sent_files=True):
+    """Creates the pipeline sending the files to google_drive (-sgd) or by mail (-m)"""
+    if args.sgd:
+        from utils.google_drive import GoogleDriveManager
+        google_drive = GoogleDriveManager(cfg.cfg_file_path)
+        return SendPipeline(partial(google_drive.send_file, base_folder_path=cfg.download_folder_path),
+                            workers=google_drive.upload_workers, remove_sent_files=remove_sent_files)
+    from utils.mail import MailBook
+    return SendPipeline(partial(send_book_by_mail, MailBook(cfg.cfg_file_path)), remove_sent_files=remove_sent_files)
+
+
+def send_book_by_mail(mail_book, file_path):
+    """
+    Sends pdf books to to_emails and mobi books to kindle_emails, the other formats aren't sent
+    :return: False if the book couldn't be sent
+    """
+    if file_path.endswith('.pdf'):
+        return mail_book.send_book(file_path)
+    if file_path.endswith('.mobi'):
+        return mail_book.send_kindle(file_path)
+    return True
+
+
+def run_once(args, cfg_file_path, ebook=None, page_data=None):
+    """
+    Runs the tasks chosen by the command line arguments, sends the failure report email if asked to and writes the
+    metrics of the run.
+    :param ebook: PacktPublishingFreeEbook to run the tasks with, created from the config file if None
+    :return: (PacktPublishingFreeEbook, whether all went well), the former is None if it couldn't be created
+    """
+    cfg = ebook.cfg if ebook is not None else None
+    succeeded = False
+    try:
+        with METRICS.phase('run'):
+            if ebook is None:
+                cfg = ConfigurationModel(cfg_file_path)
+                ebook = PacktPublishingFreeEbook(cfg)
+            run_tasks(args, cfg, ebook, page_data)
+            logger.success("Good, looks like all went well! :-)")
+        succeeded = True
+    except Exception as e:
+        logger.error("Exception occurred {}".format(e))
+        if args.status_mail:
+            from utils.mail import MailBook
+            mb = MailBook(cfg_file_path)
+            mb.send_info(
+                subject=FAILURE_EMAIL_SUBJECT.format(dt.datetime.now().strftime(DATE_FORMAT)),
+                body=FAILURE_EMAIL_BODY.format(str(e))
+            )
+    finally:
+        write_run_metrics(cfg, succeeded)
+        METRICS.reset()
+    return ebook, succeeded
+
+
+def run_batch(args, cfg_file_paths, workers):
+    """
+    Runs the tasks chosen by the command line arguments for many accounts (one config file each), up to `workers`
+    accounts at once. Every account has its own session and cookies, while all of them share the connection pool and
+    the anti-captcha clients. Ends with a report of every account written to the log and next to it.
+    :return: whether all the accounts went well
+    """
+    succeeded = False
+    try:
+        with METRICS.phase('run'):
+            succeeded = _run_batch(args, cfg_file_paths, workers)
+    except Exception as e:
+        logger.error("Exception occurred {}".format(e))
+    finally:
+        write_run_metrics(None, succeeded)
+        METRICS.reset()
+    return succeeded
+
+
+def _run_batch(args, cfg_file_paths, workers):
+    cfg_folder_paths = [os.path.dirname(os.path.abspath(path)) for path in cfg_file_paths]
+    if len(set(cfg_folder_paths)) != len(cfg_folder_paths):
+        # the session cookies, library index etc. are stored next to the config file
+        raise ValueError("The config files of the accounts must be in separate folders")
+    cfgs = {}
+    for cfg_file_path in cfg_file_paths:
+        try:
+            cfgs[cfg_file_path] = ConfigurationModel(cfg_file_path)
+        except Exception as e:
+            cfgs[cfg_file_path] = e  # reported as the failure of the account
+    max_download_workers = max([args.workers or cfg.download_workers for cfg in cfgs.values()
+                                if isinstance(cfg, ConfigurationModel)] or [1])
+    http_adapter = HTTPAdapter(pool_maxsize=workers * max_download_workers)
+    anticaptchas = {}
+    anticaptchas_lock = threading.Lock()
+    phases = METRICS.current_phases()
+
+    def run_account(cfg_file_path):
+        cfg = cfgs[cfg_file_path]
+        if not isinstance(cfg, ConfigurationModel):
+            raise cfg
+        anticaptcha_key = (cfg.anticaptcha_clientkey, cfg.anticaptcha_api_url, cfg.anticaptcha_initial_delay_sec)
+        with anticaptchas_lock:
+            if anticaptcha_key not in anticaptchas:
+                anticaptchas[anticaptcha_key] = Anticaptcha(cfg.anticaptcha_clientkey, cfg.anticaptcha_api_url,
+                                                            initial_delay_sec=cfg.anticaptcha_initial_delay_sec)
+        ebook = PacktPublishingFreeEbook(cfg, http_adapter=http_adapter, anticaptcha=anticaptchas[anticaptcha_key])
+        work_folder_path = tempfile.mkdtemp(prefix='packt_')  # the accounts may grab the same ebook
+        try:
+            with METRICS.continue_phases(phases):
+                run_tasks(args, cfg, ebook, work_folder_path=work_folder_path)
+        except Exception as e:
+            if args.status_mail:
+                from utils.mail import MailBook
+                MailBook(cfg_file_path).send_info(
+                    subject=FAILURE_EMAIL_SUBJECT.format(dt.datetime.now().strftime(DATE_FORMAT)),
+                    body=FAILURE_EMAIL_BODY.format(str(e))
+                )
+            raise
+        finally:
+            shutil.rmtree(work_folder_path, ignore_errors=True)
+
+    results = run_accounts(cfg_file_paths, run_account, workers)
+    logger.success("Batch report:\n{}".format(format_report(results)))
+    write_report(results, os.path.join(os.path.dirname(get_log_file_path()), BATCH_REPORT_FILE_NAME))
+    return all(result.succeeded for result in results)
+
+
 # Main
 if __name__ == '__main__':
 
@@ -347,84 +969,56 @@ if __name__ == '__main__':
                         action="store_true")
     parser.add_argument("-f", "--folder", help="downloads eBook into a folder", default=False,
                         action="store_true")
+    parser.add_argument("-w", "--workers", help="number of files downloaded concurrently (overrides config file)",
+                        type=int, default=None)
     parser.add_argument("-c", "--cfgpath", help="select folder where config file can be found",
                         default=os.path.join(os.getcwd(), "configFile.cfg"))
     parser.add_argument("--noauth_local_webserver", help="set if you want auth google_drive without local browser",
                         action="store_true")
+    parser.add_argument("--log_json", help="writes the log file as json lines (LOG_FILE.jsonl)",
+                        action="store_true")
+    parser.add_argument("--stream", help="with -sgd, streams the ebook from Packt straight to Google Drive without "
+                        "writing it to disk", action="store_true")
+    parser.add_argument("--profile", help="profiles cpu time and memory peak of each phase into files next to the log",
+                        action="store_true")
+    parser.add_argument("--profile_collapsed", help="with --profile, writes also collapsed stacks for flame graphs",
+                        action="store_true")
+    parser.add_argument("--daemon", help="keeps running and repeats the chosen tasks as soon as a new ebook is offered",
+                        action="store_true")
+    parser.add_argument("--batch", help="runs the chosen tasks for many accounts, given by their config files",
+                        nargs='+', metavar='CFG_PATH')
+    parser.add_argument("--batch_workers", help="number of accounts run concurrently in batch mode",
+                        type=int, default=4)
 
     args = parser.parse_args()
+    if args.daemon and args.batch:
+        parser.error("--daemon can't be combined with --batch, run a daemon per account instead")
+    if args.stream and not args.sgd:
+        parser.error("--stream works only with -sgd")
+    if args.stream and (args.grabd or args.dall or args.dchosen or args.mail):
+        parser.error("--stream can't be combined with -gd, -da, -dc or -m, which need the files on disk")
+    if args.log_json:
+        configure_logging(json_lines=True)
     cfg_file_path = args.cfgpath
-    into_folder = args.folder
+    profiler = None
+    if args.profile:
+        profiler = PhaseProfiler(METRICS, PROFILED_PHASES)
+        profiler.start()
 
-    try:
-        cfg = ConfigurationModel(cfg_file_path)
-        ebook = PacktPublishingFreeEbook(cfg)
-
-        # Grab the newest book
-        if args.grab or args.grabl or args.grabd or args.sgd or args.mail:
-            ebook.grab_ebook(log_ebook_infodata=args.grabl)
+    if args.batch:
+        ebook, succeeded = None, run_batch(args, args.batch, args.batch_workers)
+    else:
+        ebook, succeeded = run_once(args, cfg_file_path)
+    if profiler is not None:
+        profiler.stop()
+        profiler.write(os.path.dirname(get_log_file_path()), collapsed_stacks=args.profile_collapsed)
 
-            # Send email about successful book grab. Do it only when book
-            # isn't going to be emailed as we don't want to send email twice.
-            if args.status_mail and not args.mail:
-                from utils.mail import MailBook
-                mb = MailBook(cfg_file_path)
-                mb.send_info(
-                    subject=SUCCESS_EMAIL_SUBJECT.format(
-                        dt.datetime.now().strftime(DATE_FORMAT),
-                        ebook.book_title
-                    ),
-                    body=SUCCESS_EMAIL_BODY.format(ebook.book_title)
-                )
-
-        # Download book(s) into proper location
-        if args.grabd or args.dall or args.dchosen or args.sgd or args.mail:
-            if args.dall:
-                ebook.download_books(into_folder=into_folder)
-            elif args.dchosen:
-                ebook.download_books(cfg.download_book_titles, into_folder=into_folder)
-            elif args.grabd:
-                ebook.download_books([ebook.book_title], into_folder=into_folder)
-            else:
-                cfg.download_folder_path = os.getcwd()
-                ebook.download_books([ebook.book_title], into_folder=into_folder)
-
-        # Send downloaded book(s) by mail or to google_drive
-        if args.sgd or args.mail:
-            paths = [
-                os.path.join(cfg.download_folder_path, path)
-                for path in os.listdir(cfg.download_folder_path)
-                if os.path.isfile(path) and ebook.book_title in path
-            ]
-            if args.sgd:
-                from utils.google_drive import GoogleDriveManager
-                google_drive = GoogleDriveManager(cfg_file_path)
-                google_drive.send_files(paths)
-            else:
-                from utils.mail import MailBook
-                mb = MailBook(cfg_file_path)
-                pdf_path = None
-                mobi_path = None
-                try:
-                    pdf_path = [path for path in paths if path.endswith('.pdf')][-1]
-                    mobi_path = [path for path in paths if path.endswith('.mobi')][-1]
-                except IndexError:
-                    pass
-                if pdf_path:
-                    mb.send_book(pdf_path)
-                if mobi_path:
-                    mb.send_kindle(mobi_path)
-            for path in paths:
-                os.remove(path)
-
-        logger.success("Good, looks like all went well! :-)")
-    except Exception as e:
-        logger.error("Exception occurred {}".format(e))
-        if args.status_mail:
-            from utils.mail import MailBook
-            mb = MailBook(cfg_file_path)
-            mb.send_info(
-                subject=FAILURE_EMAIL_SUBJECT.format(dt.datetime.now().strftime(DATE_FORMAT)),
-                body=FAILURE_EMAIL_BODY.format(str(e))
-            )
+    if args.daemon and ebook is not None:
+        daemon = FreeLearningDaemon(ebook, lambda page_data: run_once(args, cfg_file_path, ebook, page_data),
+                                    **ebook.cfg.daemon_settings)
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            logger.info("Daemon stopped")
+    elif not succeeded:
         sys.exit(2)
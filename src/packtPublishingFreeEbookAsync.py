@@ -0,0 +1,358 @@
+"""
+Asyncio flavour of PacktPublishingFreeEbook, python 3.7+ only (needs aiohttp).
+Its session creation, grab_ebook and download_books are coroutines sending the requests with an aiohttp session, so a
+single event loop can run many of them at once, e.g. for many accounts sharing one connector. The pages are parsed the
+same way as by PacktPublishingFreeEbook; the parsing and the file and sqlite I/O are run in the default executor, so
+they don't hold the loop up.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+
+import aiohttp
+import requests
+from yarl import URL
+
+from packtPublishingFreeEbook import SESSION_PROBE_MAX_BYTES, EbookAccountMixin
+from utils.anticaptcha import Anticaptcha
+from utils.downloader import (PART_FILE_SUFFIX, DownloadWriter, choose_chunk_size, close_download, open_download,
+                              read_part_offset)
+from utils.html_parser import get_book_details, get_free_learning_data, get_login_form_build_id, get_my_books_data
+from utils.logger import get_logger
+from utils.metrics import METRICS
+from utils.session_cache import SessionCache
+
+logger = get_logger(__name__)
+
+
+@contextmanager
+def _recorded_phase(name):
+    """
+    Records a run of the phase like METRICS.phase, which can't be used by coroutines as they share the thread.
+    The requests and bytes of the phase are added by the caller to the yielded dict.
+    """
+    counts = {'requests': 0, 'bytes': 0}
+    start_time = time.time()
+    try:
+        yield counts
+    finally:
+        METRICS.record_run(name, time.time() - start_time, **counts)
+
+
+async def _run_blocking(function, *args):
+    """Runs a blocking call (parsing, file or sqlite I/O) in the default executor, so it doesn't hold the loop up"""
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def download_file_async(session, url, file_path, timeout=100):
+    """
+    Same as utils.downloader.download_file, with an aiohttp session
+    :param timeout: seconds to wait for the connection and for every read
+    :return: number of bytes received by this call
+    """
+    part_path = file_path + PART_FILE_SUFFIX
+    offset = await _run_blocking(read_part_offset, part_path)
+    headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+    async with session.get(url, timeout=client_timeout, headers=headers) as r:
+        download_range = await _run_blocking(open_download, part_path, file_path, url, offset, r.status,
+                                             r.headers.get('content-range'), r.headers.get('content-length'))
+        if download_range is None:
+            return 0
+        offset, total_length = download_range
+        remaining_length = total_length - offset if total_length is not None else None
+        writer = await _run_blocking(DownloadWriter, part_path, offset, total_length)
+        try:
+            async for chunk in r.content.iter_chunked(choose_chunk_size(remaining_length)):
+                await _run_blocking(writer.write, chunk)
+        finally:
+            await _run_blocking(writer.close)
+        await _run_blocking(close_download, writer, part_path, file_path, total_length)
+        return writer.received
+
+
+class AsyncPacktPublishingFreeEbook(EbookAccountMixin):
+    """
+    Asyncio counterpart of PacktPublishingFreeEbook, whose create_session, grab_ebook and download_books are
+    coroutines, e.g.
+
+        async with AsyncPacktPublishingFreeEbook(ConfigurationModel(cfg_file_path)) as ebook:
+            await ebook.grab_ebook()
+            await ebook.download_books([ebook.book_title])
+
+    The session is closed by leaving the `async with` block, or by awaiting close().
+    """
+
+    session = None
+
+    def __init__(self, cfg, connector=None, anticaptcha=None, page_timeout_sec=None, download_timeout_sec=None):
+        """
+        :param connector: aiohttp connector (connection pool) the session sends the requests with, e.g. shared by many
+                          accounts, the session has a connector of its own if None
+        :param anticaptcha: Anticaptcha client solving the captchas, e.g. shared by many accounts, one is created on
+                            the first captcha and closed together with the session if None
+        """
+        EbookAccountMixin.__init__(self, cfg, anticaptcha=anticaptcha, page_timeout_sec=page_timeout_sec,
+                                   download_timeout_sec=download_timeout_sec)
+        self.connector = connector
+        self._owns_anticaptcha = anticaptcha is None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self._owns_anticaptcha and self.anticaptcha is not None:
+            await self.anticaptcha.close_async()
+
+    def __get_anticaptcha(self):
+        if self.anticaptcha is None:
+            self.anticaptcha = Anticaptcha(self.cfg.anticaptcha_clientkey, self.cfg.anticaptcha_api_url,
+                                           initial_delay_sec=self.cfg.anticaptcha_initial_delay_sec)
+        return self.anticaptcha
+
+    async def __request(self, method, url, counts, session=None, **kwargs):
+        """
+        :param session: the session sending the request, the logged in one if None
+        :return: (status, headers, text) of the response
+        """
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.page_timeout_sec,
+                                        sock_read=self.page_timeout_sec)
+        async with (session or self.session).request(method, url, timeout=timeout, **kwargs) as r:
+            content = await r.read()
+            counts['requests'] += 1
+            counts['bytes'] += len(content)
+            return r.status, r.headers, await r.text()
+
+    async def create_session(self):
+        """Logs in, unless the cookies stored by the previous run still keep us logged in"""
+        if self.session is not None:
+            return
+        with _recorded_phase('session') as counts:
+            session = aiohttp.ClientSession(headers=self.cfg.req_headers, connector=self.connector,
+                                            connector_owner=self.connector is None,
+                                            cookie_jar=aiohttp.CookieJar(unsafe=True))  # accepts ip address hosts
+            try:
+                if await self.__restore_session(session, counts):
+                    logger.info("Stored session restored, logged in successfully!")
+                else:
+                    session.cookie_jar.clear()
+                    await self.__login(session, counts)
+            except BaseException:
+                await session.close()
+                raise
+            self.session = session
+
+    async def __restore_session(self, session, counts):
+        cookies = requests.Session().cookies
+        session_cache = SessionCache(self.cfg.session_cache_file_path)
+        if not await _run_blocking(session_cache.load, _CookieHolder(cookies)):
+            return False
+        for cookie in cookies:
+            session.cookie_jar.update_cookies({cookie.name: cookie.value}, response_url=URL(self.cfg.packtpub_url))
+        if not await self.__is_logged_in(session, counts):
+            logger.info("Stored session has expired")
+            await _run_blocking(session_cache.clear)
+            return False
+        return True
+
+    async def __is_logged_in(self, session, counts):
+        """Cheap login probe, reads only the beginning of my-ebooks page without following redirects"""
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.page_timeout_sec,
+                                        sock_read=self.page_timeout_sec)
+        try:
+            async with session.get(self.cfg.my_books_url, timeout=timeout, allow_redirects=False) as r:
+                counts['requests'] += 1
+                if r.status != 200:
+                    return False
+                head = b''
+                async for chunk in r.content.iter_chunked(8192):
+                    head += chunk
+                    if b"register-page-form" in head:
+                        return False
+                    if len(head) >= SESSION_PROBE_MAX_BYTES:
+                        break
+                counts['bytes'] += len(head)
+                return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Session probe failed: {}".format(e))
+            return False
+
+    async def __login(self, session, counts):
+        form_data = {'email': self.cfg.my_packt_email,
+                     'password': self.cfg.my_packt_password,
+                     'op': 'Login',
+                     'form_build_id': '',
+                     'form_id': 'packt_user_login_form'}
+        logger.info("Creating session...")
+        _, _, text = await self.__request('get', self.cfg.login_url, counts, session=session)
+        form_data['form_build_id'] = get_login_form_build_id(text)
+        await self.__request('post', self.cfg.login_url, counts, session=session, data=form_data)
+        # check once again if we are really logged into the server
+        status, _, text = await self.__request('get', self.cfg.my_books_url, counts, session=session)
+        if status != 200 or text.find("register-page-form") != -1:
+            message = "Login failed!"
+            logger.error(message)
+            raise requests.exceptions.RequestException(message)
+        logger.info("Session created, logged in successfully!")
+        cookies = requests.Session().cookies
+        for morsel in session.cookie_jar:
+            cookies.set(morsel.key, morsel.value, domain=morsel['domain'], path=morsel['path'] or '/')
+        await _run_blocking(SessionCache(self.cfg.session_cache_file_path).save, _CookieHolder(cookies))
+
+    async def grab_ebook(self, log_ebook_infodata=False, page_data=None):
+        """
+        Grabs the ebook
+        :param page_data: free-learning page data, the page is fetched if None
+        """
+        with _recorded_phase('grab'):
+            logger.info("Start grabbing eBook...")
+            url = self.cfg.freelearning_url
+            presolved_captcha = (None, None)
+            if page_data is None:
+                presolved_captcha = await self.__presolve_captcha(url)
+            try:
+                await self.create_session()
+                if page_data is None:
+                    page_data = await self.__get_free_learning_data(url)
+                if page_data['claim_url'] is None:
+                    status, text = await self.__claim_ebook_captchafull(url, page_data, presolved_captcha)
+                else:
+                    logger.info("No captcha detected.")
+                    await _run_blocking(self._forget_website_key)
+                    with _recorded_phase('claim') as counts:
+                        status, _, text = await self.__request('get', self.cfg.packtpub_url + page_data['claim_url'],
+                                                               counts)
+            finally:
+                _discard_captcha_solution(presolved_captcha[1])
+            self._check_claim_response(page_data, status, text)
+            if log_ebook_infodata:
+                logger.info("Retrieving complete information for '{}'".format(self.book_title))
+                with _recorded_phase('book_info') as counts:
+                    _, _, book_page = await self.__request('get', self.cfg.packtpub_url + page_data['book_url'],
+                                                           counts)
+                book_details = await _run_blocking(get_book_details, book_page)
+                await _run_blocking(self._save_ebook_infodata, book_details)
+
+    async def __presolve_captcha(self, url):
+        """Same as PacktPublishingFreeEbook.__presolve_captcha, the solution is an asyncio future"""
+        website_key = await _run_blocking(self._get_known_website_key)
+        if website_key is None:
+            return None, None
+        logger.info("Solving captcha in the background...")
+        return website_key, asyncio.ensure_future(self.__get_anticaptcha().solve_recaptcha_async(url, website_key))
+
+    async def __get_free_learning_data(self, url):
+        with _recorded_phase('free_learning') as counts:
+            status, _, text = await self.__request('get', url, counts)
+        if status != 200:
+            raise requests.exceptions.RequestException("http GET status code != 200")
+        with _recorded_phase('parse'):
+            return await _run_blocking(get_free_learning_data, text)
+
+    async def __claim_ebook_captchafull(self, url, page_data, presolved_captcha):
+        """:return: (status, text) of the claim response"""
+        logger.info("Captcha detected. Trying to solve it using anti-captcha.com.")
+        presolved_website_key, captcha_solution = presolved_captcha
+        captcha_solved_id = None
+        if captcha_solution is not None and presolved_website_key == page_data['website_key']:
+            try:
+                with _recorded_phase('captcha_wait'):
+                    captcha_solved_id = await captcha_solution
+            except Exception as e:
+                logger.warning("Captcha solving in the background failed: {}, retrying...".format(e))
+        if captcha_solved_id is None:
+            captcha_solved_id = await self.__get_anticaptcha().solve_recaptcha_async(url, page_data['website_key'])
+        await _run_blocking(self._remember_website_key, page_data['website_key'], presolved_website_key)
+        with _recorded_phase('claim') as counts:
+            status, _, text = await self.__request('post', self.cfg.packtpub_url + page_data['claim_form_url'], counts,
+                                                   data={'g-recaptcha-response': captcha_solved_id})
+        return status, text
+
+    async def download_books(self, titles=None, formats=None, into_folder=False, workers=None, title_matching=None):
+        """
+        Downloads the ebooks, see PacktPublishingFreeEbook.download_books
+        :param workers: number of files downloaded concurrently, taken from config file if None
+        :return: list of (download task, exception) tuples describing the failed downloads
+        """
+        if title_matching is None:
+            title_matching = self.cfg.download_title_matching
+        if workers is None:
+            workers = self.cfg.download_workers
+        await self.create_session()
+        await self.__get_my_all_books_data(titles, title_matching)
+        download_tasks, existing_file_paths = await _run_blocking(self._get_download_tasks, titles, formats,
+                                                                  into_folder, title_matching)
+        semaphore = asyncio.Semaphore(max(workers, 1))
+
+        async def download(task):
+            async with semaphore:
+                try:
+                    await self.__download_file(task)
+                except Exception as e:
+                    logger.error(e)
+                    return task, e
+
+        with _recorded_phase('download'):
+            results = await asyncio.gather(*[download(task) for task in download_tasks])
+        failed_downloads = [result for result in results if result is not None]
+        self._log_download_results(download_tasks, len(existing_file_paths), failed_downloads)
+        return failed_downloads
+
+    async def __get_my_all_books_data(self, titles, title_matching):
+        library_index = await _run_blocking(self._load_library_index, titles, title_matching)
+        if library_index is None:
+            return
+        request_headers = await _run_blocking(self._get_library_request_headers, library_index)
+        with _recorded_phase('library') as counts:
+            logger.info("Getting data of all your books...")
+            status, headers, text = await self.__request('get', self.cfg.my_books_url, counts,
+                                                         headers=request_headers)
+        if status == 304:
+            logger.info("Your library hasn't changed, using the local library index")
+            return
+        if status != 200:
+            message = "Cannot open {}, http GET status code != 200".format(self.cfg.my_books_url)
+            logger.error(message)
+            raise requests.exceptions.RequestException(message)
+        logger.info("Opened '{}' successfully!".format(self.cfg.my_books_url))
+        with _recorded_phase('parse'):
+            self._load_book_data(await _run_blocking(get_my_books_data, text, self.download_formats))
+        await _run_blocking(library_index.update, self.book_data, headers.get('etag'), headers.get('last-modified'))
+
+    async def __download_file(self, task):
+        title = task['title']
+        if task['form'] == 'code':
+            logger.info("Downloading code for eBook: '{}'...".format(title))
+        else:
+            logger.info("Downloading eBook: '{}' in .{} format...".format(title, task['form']))
+        with _recorded_phase('download_file') as counts:
+            counts['requests'] += 1
+            counts['bytes'] += await download_file_async(self.session, task['url'], task['file_path'],
+                                                         timeout=self.download_timeout_sec)
+        if task['form'] == 'code':
+            logger.success("Code for eBook: '{}' downloaded successfully!".format(title))
+        else:
+            logger.success("eBook: '{}.{}' downloaded successfully!".format(title, task['form']))
+
+
+class _CookieHolder(object):
+    """The `cookies` of a requests.Session, which is all SessionCache needs"""
+
+    def __init__(self, cookies):
+        self.cookies = cookies
+
+
+def _discard_captcha_solution(captcha_solution):
+    """Cancels the captcha solved in the background if it's still pending, or retrieves its outcome otherwise"""
+    if captcha_solution is None:
+        return
+    if captcha_solution.done() and not captcha_solution.cancelled():
+        captcha_solution.exception()  # retrieved, so it isn't reported as never retrieved
+    else:
+        captcha_solution.cancel()
@@ -1,7 +1,11 @@
-import requests
+import threading
 import time
+from concurrent.futures import Future
+
+import requests
 
 from .logger import get_logger
+from .metrics import METRICS
 logger = get_logger(__name__)
 
 
@@ -15,17 +19,70 @@ class Anticaptcha(object):
     More info concerning the API: https://anti-captcha.com/apidoc/
     """
     api_url = 'https://api.anti-captcha.com'
-    create_task_url = api_url + '/createTask'
-    get_task_result_url = api_url + '/getTaskResult'
     # During busy periods, may need to wait more than 2 mins to solve Captcha.
     timeout_time_sec = 180  # timeout
+    request_timeout_sec = 10  # of every api request
+    # A reCaptcha is never solved within the first seconds, so the results are polled only after initial_delay_sec,
+    # then with intervals growing from min_poll_interval_sec by poll_backoff times up to max_poll_interval_sec.
+    initial_delay_sec = 3.0
+    min_poll_interval_sec = 0.5
+    max_poll_interval_sec = 2.0
+    poll_backoff = 1.5
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, api_url=None, initial_delay_sec=None, min_poll_interval_sec=None,
+                 max_poll_interval_sec=None, poll_backoff=None, session=None, request_timeout_sec=None):
+        """
+        :param session: requests.Session to send the requests with, a new one is created if None
+        """
         self.api_key = api_key
-        self.session = requests.Session()
+        if api_url is not None:
+            self.api_url = api_url.rstrip('/')
+        if initial_delay_sec is not None:
+            self.initial_delay_sec = initial_delay_sec
+        if min_poll_interval_sec is not None:
+            self.min_poll_interval_sec = min_poll_interval_sec
+        if max_poll_interval_sec is not None:
+            self.max_poll_interval_sec = max_poll_interval_sec
+        if poll_backoff is not None:
+            self.poll_backoff = poll_backoff
+        if request_timeout_sec is not None:
+            self.request_timeout_sec = request_timeout_sec
+        self.create_task_url = self.api_url + '/createTask'
+        self.get_task_result_url = self.api_url + '/getTaskResult'
+        self.session = session if session is not None else requests.Session()
+        self.async_session = None  # aiohttp.ClientSession shared by the async calls, see solve_recaptcha_async
+        self._metrics_lock = threading.Lock()
+        self._metrics = {'requests': 0, 'tasks': 0, 'solved': 0, 'solve_time_sec_total': 0.0,
+                         'solve_time_sec_max': 0.0}
 
-    def __post_request(self, url, **kwargs):
-        response = self.session.post(url, **kwargs).json()
+    @property
+    def metrics(self):
+        """Number of api requests, created tasks, solved tasks and the solve times (average and max) so far"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics['solve_time_sec_avg'] = metrics['solve_time_sec_total'] / metrics['solved'] if metrics['solved'] else 0
+        return metrics
+
+    def _record_metrics(self, api_requests=0, tasks=0, solve_time_sec=None):
+        with self._metrics_lock:
+            self._metrics['requests'] += api_requests
+            self._metrics['tasks'] += tasks
+            if solve_time_sec is not None:
+                self._metrics['solved'] += 1
+                self._metrics['solve_time_sec_total'] += solve_time_sec
+                self._metrics['solve_time_sec_max'] = max(self._metrics['solve_time_sec_max'], solve_time_sec)
+
+    def poll_delays(self):
+        """Yields the delays to wait before each getTaskResult request"""
+        yield self.initial_delay_sec
+        interval = self.min_poll_interval_sec
+        while True:
+            yield interval
+            interval = min(interval * self.poll_backoff, self.max_poll_interval_sec)
+
+    def _check_response(self, response):
+        self._record_metrics(api_requests=1)
+        METRICS.add(requests=1)
         if response.get('errorId'):
             raise AnticaptchaException("Error {0} occured: {1}".format(
                 response.get('errorCode'),
@@ -33,8 +90,8 @@ class Anticaptcha(object):
             ))
         return response
 
-    def __create_noproxy_task(self, website_url, website_key):
-        content = {
+    def _create_task_content(self, website_url, website_key):
+        return {
             'clientKey': self.api_key,
             'task': {
                 "type": "NoCaptchaTaskProxyless",
@@ -42,26 +99,78 @@ class Anticaptcha(object):
                 "websiteKey": website_key
             }
         }
-        response = self.__post_request(self.create_task_url, json=content)
-        return response.get('taskId')
 
-    def __wait_for_task_result(self, task_id):
-        start_time = time.time()
-        content = {
+    def _task_result_content(self, task_id):
+        return {
             'clientKey': self.api_key,
             'taskId': task_id
         }
-        while (time.time() - start_time) < self.timeout_time_sec:
+
+    def __post_request(self, url, **kwargs):
+        return self._check_response(self.session.post(url, timeout=self.request_timeout_sec, **kwargs).json())
+
+    def __create_noproxy_task(self, website_url, website_key):
+        response = self.__post_request(self.create_task_url, json=self._create_task_content(website_url, website_key))
+        self._record_metrics(tasks=1)
+        return response.get('taskId')
+
+    def __wait_for_task_result(self, task_id):
+        start_time = time.time()
+        content = self._task_result_content(task_id)
+        for delay in self.poll_delays():
+            if (time.time() - start_time) + delay >= self.timeout_time_sec:
+                break
+            time.sleep(delay)
             response = self.__post_request(self.get_task_result_url, json=content)
             if response.get('status') == 'ready':
                 return response
-            time.sleep(1)
         raise AnticaptchaException('Timeout {} reached '.format(self.timeout_time_sec))
 
     def solve_recaptcha(self, website_url, website_key):
+        with METRICS.phase('captcha_solve'):
+            return self.__solve_recaptcha(website_url, website_key)
+
+    def __solve_recaptcha(self, website_url, website_key):
+        start_time = time.time()
         task_id = self.__create_noproxy_task(website_url, website_key)
         logger.info('TaskId created: {}'.format(task_id))
         logger.info('Waiting for completion of the task: {}...'.format(task_id))
         solution = self.__wait_for_task_result(task_id)['solution']['gRecaptchaResponse']
+        self._record_metrics(solve_time_sec=time.time() - start_time)
         logger.success('Solution found for task: {}'.format(task_id))
         return solution
+
+    def solve_recaptcha_async(self, website_url, website_key):
+        """
+        Asyncio flavour of solve_recaptcha (python 3.5+, needs aiohttp), many of them can be awaited at once.
+        All the calls made with this client share the connection pool of its `async_session`, which gets created on
+        the first call; close it with `await client.close_async()` when done.
+        :return: coroutine returning the solution
+        """
+        from .anticaptcha_async import solve_recaptcha
+        return solve_recaptcha(self, website_url, website_key)
+
+    def close_async(self):
+        """:return: coroutine closing the aiohttp session used by solve_recaptcha_async"""
+        from .anticaptcha_async import close_session
+        return close_session(self)
+
+    def solve_recaptcha_in_background(self, website_url, website_key):
+        """
+        Starts solving the reCaptcha in a background (daemon) thread, so it can overlap with other work.
+        :return: concurrent.futures.Future of the solution
+        """
+        future = Future()
+
+        def solve():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.solve_recaptcha(website_url, website_key))
+            except Exception as e:
+                future.set_exception(e)
+
+        thread = threading.Thread(target=solve, name='anticaptcha-{}'.format(website_key))
+        thread.daemon = True
+        thread.start()
+        return future
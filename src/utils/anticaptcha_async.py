@@ -0,0 +1,62 @@
+"""
+Asyncio counterpart of the Anticaptcha requests, python 3.5+ only (needs aiohttp).
+Kept apart from anticaptcha.py so that module stays importable on python 2, use it via
+Anticaptcha.solve_recaptcha_async and Anticaptcha.close_async.
+"""
+import asyncio
+import time
+
+import aiohttp
+
+from .anticaptcha import AnticaptchaException
+from .logger import get_logger
+from .metrics import METRICS
+logger = get_logger(__name__)
+
+
+def get_session(client):
+    """Returns the aiohttp session of the client, all its async calls share the connection pool of it"""
+    if client.async_session is None or client.async_session.closed:
+        client.async_session = aiohttp.ClientSession()
+    return client.async_session
+
+
+async def close_session(client):
+    if client.async_session is not None:
+        await client.async_session.close()
+        client.async_session = None
+
+
+async def post_request(client, url, content):
+    timeout = aiohttp.ClientTimeout(total=client.request_timeout_sec)
+    async with get_session(client).post(url, json=content, timeout=timeout) as response:
+        return client._check_response(await response.json(content_type=None))
+
+
+async def wait_for_task_result(client, task_id):
+    start_time = time.time()
+    content = client._task_result_content(task_id)
+    for delay in client.poll_delays():
+        if (time.time() - start_time) + delay >= client.timeout_time_sec:
+            break
+        await asyncio.sleep(delay)
+        response = await post_request(client, client.get_task_result_url, content)
+        if response.get('status') == 'ready':
+            return response
+    raise AnticaptchaException('Timeout {} reached '.format(client.timeout_time_sec))
+
+
+async def solve_recaptcha(client, website_url, website_key):
+    start_time = time.time()
+    response = await post_request(client, client.create_task_url,
+                                  client._create_task_content(website_url, website_key))
+    client._record_metrics(tasks=1)
+    task_id = response.get('taskId')
+    logger.info('TaskId created: {}'.format(task_id))
+    logger.info('Waiting for completion of the task: {}...'.format(task_id))
+    solution = (await wait_for_task_result(client, task_id))['solution']['gRecaptchaResponse']
+    client._record_metrics(solve_time_sec=time.time() - start_time)
+    # the concurrent coroutines share the thread, so the phase is timed here instead of by METRICS.phase
+    METRICS.record_run('captcha_solve', time.time() - start_time)
+    logger.success('Solution found for task: {}'.format(task_id))
+    return solution
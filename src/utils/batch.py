@@ -0,0 +1,50 @@
+import json
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+BATCH_REPORT_FILE_NAME = 'packt_batch_report.json'
+
+AccountResult = namedtuple('AccountResult', ['cfg_file_path', 'succeeded', 'duration_sec', 'error'])
+
+
+def run_accounts(cfg_file_paths, run_account, workers):
+    """
+    Calls run_account(cfg_file_path) for every account config file, up to `workers` accounts at once
+    :return: list of AccountResult, in the order of cfg_file_paths
+    """
+    def run(cfg_file_path):
+        start_time = time.time()
+        try:
+            run_account(cfg_file_path)
+        except Exception as e:
+            logger.error("Account '{}' failed: {}".format(cfg_file_path, e))
+            return AccountResult(cfg_file_path, False, time.time() - start_time, str(e))
+        return AccountResult(cfg_file_path, True, time.time() - start_time, None)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(run, cfg_file_paths))
+
+
+def format_report(results):
+    """:return: table of the account results, followed by a summary line"""
+    path_width = max([len('config file')] + [len(result.cfg_file_path) for result in results])
+    lines = ['{:<{width}}  {:>8}  {:>9}  {}'.format('config file', 'status', 'time [s]', 'error', width=path_width)]
+    for result in results:
+        lines.append('{:<{width}}  {:>8}  {:>9.2f}  {}'.format(
+            result.cfg_file_path, 'ok' if result.succeeded else 'FAILED', result.duration_sec, result.error or '',
+            width=path_width))
+    succeeded = sum(1 for result in results if result.succeeded)
+    durations = sorted(result.duration_sec for result in results)
+    lines.append('{} of {} accounts succeeded, time per account: median {:.2f} s, max {:.2f} s'.format(
+        succeeded, len(results), durations[len(durations) // 2] if durations else 0, durations[-1] if durations else 0))
+    return '\n'.join(lines)
+
+
+def write_report(results, file_path):
+    with open(file_path, 'w') as f:
+        json.dump([result._asdict() for result in results], f, indent=2)
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class FreeLearningDaemon(object):
+    """
+    Keeps a logged in PacktPublishingFreeEbook and runs a callback as soon as a new free ebook is offered.
+    From poll_lead_sec before the daily rotation_time (UTC) until the new ebook shows up, or poll_window_sec after the
+    rotation at the latest, the free-learning page is polled every poll_interval_sec with conditional requests.
+    The captcha of the claim is solved in the background as the polling starts, so the new ebook is claimed at once.
+    A background thread keeps the session alive (logging in again when it has expired) every
+    session_refresh_interval_sec, polling the page as well, so an ebook offered at an unexpected time isn't missed.
+    """
+
+    def __init__(self, ebook, on_new_offer, rotation_time=(0, 0), poll_lead_sec=60, poll_window_sec=900,
+                 poll_interval_sec=5, session_refresh_interval_sec=1800):
+        """
+        :param on_new_offer: called with the free-learning page data (see get_free_learning_data) of a new offer
+        :param rotation_time: (hour, minute) UTC the offer changes at every day
+        """
+        self.ebook = ebook
+        self.on_new_offer = on_new_offer
+        self.rotation_time = rotation_time
+        self.poll_lead_sec = poll_lead_sec
+        self.poll_window_sec = poll_window_sec
+        self.poll_interval_sec = poll_interval_sec
+        self.session_refresh_interval_sec = session_refresh_interval_sec
+        self.offer_title = None
+        self._lock = threading.Lock()  # the session is used by one thread at a time
+        self._stop_event = threading.Event()
+        self._handled_rotation = None
+
+    def next_rotation(self, now):
+        """:return: timestamp of the next rotation whose poll window hasn't ended or been handled yet"""
+        hour, minute = self.rotation_time
+        rotation = now - now % SECONDS_PER_DAY + hour * 3600 + minute * 60
+        while rotation + self.poll_window_sec <= now or rotation == self._handled_rotation:
+            rotation += SECONDS_PER_DAY
+        return rotation
+
+    def check_offer(self):
+        """
+        Polls the free-learning page and calls on_new_offer if the offered title has changed since the last poll
+        :return: True if a new offer has been found
+        """
+        with self._lock:
+            try:
+                page_data = self.ebook.poll_free_learning_page()
+            except Exception as e:
+                logger.warning("Polling the free-learning page failed: {}".format(e))
+                return False
+            if page_data is None or page_data['title'].strip() == self.offer_title:
+                return False
+            first_poll = self.offer_title is None
+            self.offer_title = page_data['title'].strip()
+            if first_poll:
+                logger.info("Currently offered free ebook: '{}'".format(self.offer_title))
+                return False
+            logger.success("New free ebook offered: '{}'".format(self.offer_title))
+            self.on_new_offer(page_data)
+            return True
+
+    def __keep_session_alive(self):
+        while not self._stop_event.wait(self.session_refresh_interval_sec):
+            with self._lock:
+                try:
+                    if self.ebook.refresh_session():
+                        logger.info("Session refreshed")
+                except Exception as e:
+                    logger.warning("Refreshing the session failed: {}".format(e))
+            self.check_offer()
+
+    def run(self):
+        """Runs until stop is called (by another thread)"""
+        self._stop_event.clear()
+        self.check_offer()
+        keeper = threading.Thread(target=self.__keep_session_alive, name='packt-session-keeper')
+        keeper.daemon = True
+        keeper.start()
+        try:
+            while not self._stop_event.is_set():
+                rotation = self.next_rotation(time.time())
+                logger.info("Waiting for the offer rotation at {} UTC...".format(
+                    time.strftime('%Y-%m-%d %H:%M', time.gmtime(rotation))))
+                if self._stop_event.wait(max(rotation - self.poll_lead_sec - time.time(), 0)):
+                    break
+                self.__presolve_captcha()
+                self.__poll_until_new_offer(rotation)
+                self._handled_rotation = rotation
+        finally:
+            self._stop_event.set()
+
+    def __presolve_captcha(self):
+        with self._lock:
+            try:
+                self.ebook.presolve_captcha()
+            except Exception as e:
+                logger.warning("Solving the captcha in advance failed: {}".format(e))
+
+    def __poll_until_new_offer(self, rotation):
+        logger.info("Polling the free-learning page every {} s...".format(self.poll_interval_sec))
+        while time.time() < rotation + self.poll_window_sec:
+            if self.check_offer():
+                return
+            if self._stop_event.wait(self.poll_interval_sec):
+                return
+        logger.warning("No new free ebook within {} s after the rotation".format(self.poll_window_sec))
+
+    def stop(self):
+        self._stop_event.set()
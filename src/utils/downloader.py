@@ -0,0 +1,236 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+
+import requests
+
+from .fileutils import replace_file
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+PART_FILE_SUFFIX = '.part'
+PART_OFFSET_FILE_SUFFIX = '.offset'
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+PROGRESS_REFRESH_INTERVAL_SEC = 0.2
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)')
+
+
+def _parse_content_range(content_range):
+    """Returns (first_byte, total_length) parsed from a Content-Range header, None stands for unknown"""
+    match = CONTENT_RANGE_PATTERN.match(content_range or '')
+    if match is None:
+        return None, None
+    first_byte, total_length = match.groups()
+    return (int(first_byte) if first_byte is not None else None,
+            int(total_length) if total_length != '*' else None)
+
+
+def choose_chunk_size(remaining_length):
+    """Returns the chunk size used to read a response body, ~1% of the remaining content within [64 KiB, 1 MiB]"""
+    if remaining_length is None:
+        return MIN_CHUNK_SIZE
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, remaining_length // 100))
+
+
+def read_part_offset(part_path):
+    """
+    Returns the number of valid bytes stored in a .part file.
+    A preallocated .part file is longer than its content, hence the valid length is checkpointed in a side file
+    which exists only while the file is being written (i.e. it survives only a hard crash).
+    """
+    offset_path = part_path + PART_OFFSET_FILE_SUFFIX
+    if os.path.isfile(offset_path):
+        try:
+            with open(offset_path) as f:
+                return int(f.read().strip() or 0)
+        except ValueError:
+            return 0
+    return os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+
+
+class DownloadWriter(object):
+    """
+    Writes a downloaded content into a .part file starting at the given offset.
+    Chunks are gathered in memory and written in large blocks, the file is preallocated when its final length is
+    known and it is flushed and fsync'ed only once, when the writer gets closed. Progress is reported at most every
+    PROGRESS_REFRESH_INTERVAL_SEC seconds.
+    """
+
+    def __init__(self, part_path, offset=0, total_length=None, preallocate=True, progress_callback=None,
+                 buffer_size=WRITE_BUFFER_SIZE):
+        self.part_path = part_path
+        self.offset_path = part_path + PART_OFFSET_FILE_SUFFIX
+        self.offset = offset
+        self.total_length = total_length
+        self.progress_callback = progress_callback
+        self.buffer_size = buffer_size
+        self.received = 0
+        self._buffer = []
+        self._buffered_length = 0
+        self._last_progress_time = 0
+        self._file = open(part_path, 'r+b' if os.path.isfile(part_path) else 'wb')
+        self._file.seek(offset)
+        self._file.truncate()
+        self._preallocated = preallocate and total_length is not None and total_length > offset
+        if self._preallocated:
+            self.__checkpoint_offset()
+            self.__preallocate(total_length)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def position(self):
+        """Number of valid bytes in the .part file once all the buffered data is written"""
+        return self.offset + self.received
+
+    def __preallocate(self, total_length):
+        fallocate = getattr(os, 'posix_fallocate', None)  # not available on Windows and python 2
+        if fallocate is None:
+            return
+        try:
+            fallocate(self._file.fileno(), self.offset, total_length - self.offset)
+        except OSError as e:  # e.g. a file system not supporting it, it's just an optimization anyway
+            logger.debug("Cannot preallocate '{}': {}".format(self.part_path, e))
+
+    def __checkpoint_offset(self):
+        with open(self.offset_path, 'w') as f:
+            f.write(str(self.position - self._buffered_length))
+
+    def __write_buffer(self):
+        if not self._buffer:
+            return
+        self._file.write(b''.join(self._buffer))
+        self._buffer = []
+        self._buffered_length = 0
+        if self._preallocated:
+            self.__checkpoint_offset()
+
+    def __report_progress(self, force=False):
+        if self.progress_callback is None or not self.total_length:
+            return
+        now = time.time()
+        if force or now - self._last_progress_time >= PROGRESS_REFRESH_INTERVAL_SEC:
+            self._last_progress_time = now
+            self.progress_callback(self.position / float(self.total_length))
+
+    def write(self, chunk):
+        self._buffer.append(chunk)
+        self._buffered_length += len(chunk)
+        self.received += len(chunk)
+        if self._buffered_length >= self.buffer_size:
+            self.__write_buffer()
+        self.__report_progress()
+
+    def close(self):
+        """Writes the buffered data, cuts off the unused preallocated space and syncs the file to the disk"""
+        if self._file.closed:
+            return
+        try:
+            self.__write_buffer()
+            if self._preallocated:
+                self._file.truncate(self.position)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+        if os.path.isfile(self.offset_path):
+            os.remove(self.offset_path)
+        self.__report_progress(force=True)
+
+
+def open_download(part_path, file_path, url, offset, status_code, content_range, content_length):
+    """
+    Checks the response of a download request sent with a Range header from `offset` (if not zero)
+    :return: (offset the content starts at, total length or None if unknown), None if the .part file is already
+             complete and has been renamed to file_path
+    """
+    if status_code == 416:  # nothing left to be sent, check whether the .part file is already complete
+        total_length = _parse_content_range(content_range)[1]
+        if total_length == offset:
+            DownloadWriter(part_path, offset, preallocate=False).close()  # drops a stale offset side file
+            replace_file(part_path, file_path)
+            return None
+        for path in (part_path, part_path + PART_OFFSET_FILE_SUFFIX):
+            if os.path.isfile(path):
+                os.remove(path)
+        raise requests.exceptions.RequestException(
+            "Partial download of '{}' doesn't match the remote file, removed it".format(file_path))
+    if status_code == 206:
+        first_byte, total_length = _parse_content_range(content_range)
+        if first_byte != offset:
+            raise requests.exceptions.RequestException(
+                "Unexpected range '{}' received for '{}'".format(content_range, file_path))
+        logger.info("Resuming download of '{}' from byte {}".format(file_path, offset))
+        return offset, total_length
+    if status_code == 200:  # full content, the server doesn't support ranges or there's nothing to resume
+        return 0, int(content_length) if content_length is not None else None
+    raise requests.exceptions.RequestException(
+        "Cannot download '{}', http GET status code: {}".format(url, status_code))
+
+
+def close_download(writer, part_path, file_path, total_length):
+    """Renames the .part file to file_path if the whole content has been written, raises otherwise"""
+    if total_length is not None and writer.position != total_length:
+        raise requests.exceptions.RequestException(
+            "Download of '{}' interrupted after {} of {} bytes".format(file_path, writer.position, total_length))
+    replace_file(part_path, file_path)
+
+
+def download_file(session, url, file_path, timeout=100, progress_callback=None):
+    """
+    Downloads url into file_path in a crash-safe manner.
+    The content is written into a temporary `file_path.part` file first, which is renamed to file_path only when
+    the whole content has been received. If such a .part file is left by a previous attempt the download is resumed
+    from its last valid byte using a HTTP Range request.
+    :param session: requests.Session used to send the request
+    :param progress_callback: called with the completed fraction (0.0 - 1.0) of the download
+    :return: number of bytes received by this call
+    """
+    part_path = file_path + PART_FILE_SUFFIX
+    offset = read_part_offset(part_path)
+    headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+    r = session.get(url, timeout=timeout, stream=True, headers=headers)
+    try:
+        download_range = open_download(part_path, file_path, url, offset, r.status_code,
+                                       r.headers.get('content-range'), r.headers.get('content-length'))
+        if download_range is None:
+            return 0
+        offset, total_length = download_range
+        remaining_length = total_length - offset if total_length is not None else None
+        with DownloadWriter(part_path, offset, total_length, progress_callback=progress_callback) as writer:
+            for chunk in r.iter_content(chunk_size=choose_chunk_size(remaining_length)):
+                if chunk:
+                    writer.write(chunk)
+        close_download(writer, part_path, file_path, total_length)
+        return writer.received
+    finally:
+        r.close()
+
+
+@contextmanager
+def open_download_stream(session, url, timeout=100):
+    """
+    Sends the download request of url without writing the content anywhere
+    :param session: requests.Session used to send the request
+    :return: context manager giving (iterator of the content chunks, content length), the response is closed on exit
+    """
+    r = session.get(url, timeout=timeout, stream=True)
+    try:
+        if r.status_code != 200:
+            raise requests.exceptions.RequestException(
+                "Cannot download '{}', http GET status code: {}".format(url, r.status_code))
+        content_length = r.headers.get('content-length')
+        if content_length is None:
+            raise requests.exceptions.RequestException("'{}' has no Content-Length, it can't be streamed".format(url))
+        content_length = int(content_length)
+        yield (chunk for chunk in r.iter_content(chunk_size=choose_chunk_size(content_length)) if chunk), content_length
+    finally:
+        r.close()
@@ -0,0 +1,4 @@
+import os
+
+# os.replace is atomic on every platform but doesn't exist on python 2
+replace_file = getattr(os, 'replace', os.rename)
@@ -1,23 +1,73 @@
 import argparse
 import configparser
 import io
+import json
 import logging
 import os
+import posixpath
 import sys
+import threading
+import time
 
 from apiclient import discovery
-from apiclient.http import MediaFileUpload, MediaIoBaseDownload
+from apiclient.errors import HttpError
+from apiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaUpload
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import httplib2
 from oauth2client import client, tools
 from oauth2client.file import Storage
 
+from .hash_manifest import HASH_MANIFEST_FILE_NAME, HashManifest
 from .logger import get_logger
+from .metrics import METRICS
+from .upload_sessions import UPLOAD_SESSIONS_FILE_NAME, UploadSessionStore
 
 logger = get_logger(__name__)
 
 SCOPES = 'https://www.googleapis.com/auth/drive'
 CLIENT_SECRET_FILE = 'client_secret.json'
 FILE_TYPE = frozenset(["FILE", "FOLDER"])
+FOLDER_INDEX_FILE_NAME = '.gdrive_folder_index.json'
+FOLDER_IDS_FILE_NAME = '.gdrive_folder_ids.json'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+BATCH_SIZE = 100  # the maximum number of requests in a batch request
+LIST_PAGE_SIZE = 1000  # the maximum allowed by files().list
+INDEXED_FILE_FIELDS = 'id, name, size, md5Checksum'
+SYNC_MODES = ('name', 'content')
+# the upload progress is acknowledged by the server (and stored) after every chunk
+DEFAULT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+
+def escape_query_value(value):
+    """Escapes a string literal put into a files().list query"""
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def execute_batch(service, requests, http=None):
+    """
+    Sends the requests with as few batch requests as possible.
+    :param requests: list of (request_id, request) pairs
+    :return: dict of request_id -> response, the first error is raised after all the batches have been sent
+    """
+    responses = {}
+    errors = []
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors.append(exception)
+        else:
+            responses[request_id] = response
+
+    for start in range(0, len(requests), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        for request_id, request in requests[start:start + BATCH_SIZE]:
+            batch.add(request, request_id=request_id)
+        batch.execute(http=http)
+        METRICS.add(requests=1)
+    if errors:
+        raise errors[0]
+    return responses
 
 
 class GoogleDriveManager(object):
@@ -28,8 +78,14 @@ class GoogleDriveManager(object):
         self._root_folder = GoogleDriveFile(self.folder_name)
         self._credentials = self._get_credentials()
         self._http_auth = self._credentials.authorize(httplib2.Http())
+        self._thread_local = threading.local()
         self._service = discovery.build('drive', 'v3', http=self._http_auth)
         self._root_folder.id = self.check_if_file_exist_create_new_one(self._root_folder.name)
+        self._root_folder_index = None
+        self._folder_tree = None
+        self._folder_indexes = {}
+        self._metadata_lock = threading.Lock()  # serializes the folder lookups and creations of send_file calls
+        self._upload_sessions = UploadSessionStore(self.upload_sessions_file_path)
         self._mimetypes = {
             'pdf': 'application/pdf',
             'zip': 'application/zip',
@@ -46,6 +102,20 @@ class GoogleDriveManager(object):
         self.cfg_file_path = cfg_file_path
         self.app_name = configuration.get("GOOGLE_DRIVE_DATA", 'gd_app_name')
         self.folder_name = configuration.get("GOOGLE_DRIVE_DATA", 'gd_folder_name')
+        self.folder_index_file_path = None
+        if configuration.getboolean("GOOGLE_DRIVE_DATA", 'gd_cache_folder_index', fallback=False):
+            self.folder_index_file_path = os.path.join(os.path.dirname(cfg_file_path), FOLDER_INDEX_FILE_NAME)
+        self.upload_workers = configuration.getint("GOOGLE_DRIVE_DATA", 'gd_upload_workers', fallback=1)
+        chunk_size_mb = configuration.getint("GOOGLE_DRIVE_DATA", 'gd_upload_chunk_size_mb', fallback=None)
+        # chunks have to be a multiple of 256 KiB, which any number of MiB is
+        self.upload_chunk_size = chunk_size_mb * 1024 * 1024 if chunk_size_mb else DEFAULT_UPLOAD_CHUNK_SIZE
+        self.sync_mode = configuration.get("GOOGLE_DRIVE_DATA", 'gd_sync_mode', fallback='name')
+        if self.sync_mode not in SYNC_MODES:
+            raise ValueError("Incorrect gd_sync_mode value. Allowed modes are: {}".format(', '.join(SYNC_MODES)))
+        self.hash_manifest_file_path = os.path.join(os.path.dirname(cfg_file_path), HASH_MANIFEST_FILE_NAME)
+        self.upload_sessions_file_path = os.path.join(os.path.dirname(cfg_file_path), UPLOAD_SESSIONS_FILE_NAME)
+        self.mirror_folders = configuration.getboolean("GOOGLE_DRIVE_DATA", 'gd_mirror_folders', fallback=False)
+        self.folder_ids_file_path = os.path.join(os.path.dirname(cfg_file_path), FOLDER_IDS_FILE_NAME)
 
     def _get_credentials(self):
         """
@@ -81,9 +151,10 @@ class GoogleDriveManager(object):
             return False
         page_token = None
         if parent_id is not None:
-            query = "name = '{}' and '{}' in parents".format(file_name, parent_id)
+            query = "name = '{}' and '{}' in parents".format(escape_query_value(file_name),
+                                                             escape_query_value(parent_id))
         else:
-            query = "name = '{}'".format(file_name)
+            query = "name = '{}'".format(escape_query_value(file_name))
         while True:
             response = self._service.files().list(
                 q=query,
@@ -142,37 +213,276 @@ class GoogleDriveManager(object):
             mime_type = self._mimetypes[file_extension]
         return file_name, file_extension, mime_type
 
-    def __insert_file_into_folder(self, file_name, path, parent_folder_id, file_mime_type=None):
+    def __insert_file_into_folder(self, file_name, path, parent_folder_id, file_mime_type=None, file_id=None,
+                                  media=None):
+        """
+        Uploads a new file, or new content of the existing file_id if given
+        :param media: MediaUpload of the content, the file at path is uploaded if None
+        """
         parent_id = parent_folder_id if parent_folder_id is None else [parent_folder_id]
         file_metadata = {
           'name': file_name,
           'parents': parent_id
         }
-        media = MediaFileUpload(
-            path,
-            mimetype=file_mime_type,  # if None, it will be guessed
-            resumable=True
-        )
-        file = self._service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        if media is None:
+            media = MediaFileUpload(
+                path,
+                mimetype=file_mime_type,  # if None, it will be guessed
+                chunksize=self.upload_chunk_size,
+                resumable=True
+            )
+        if file_id is not None:
+            request = self._service.files().update(fileId=file_id, media_body=media, fields=INDEXED_FILE_FIELDS)
+            target = file_id
+        else:
+            request = self._service.files().create(body=file_metadata, media_body=media, fields=INDEXED_FILE_FIELDS)
+            target = '{}/{}'.format(parent_folder_id, file_name)
+        file = self.__execute_resumable_upload(request, path, target)
         logger.debug('File ID: {}'.format(file.get('id')))
-        return file.get('id')
+        return file
+
+    def __execute_resumable_upload(self, request, path, target):
+        """
+        Sends the upload chunk by chunk, storing the session uri and the offset acknowledged by the server after every
+        chunk, so an interrupted upload of the same file to the same target is resumed from there by the next run.
+        Streamed uploads can't be resumed, as their content is gone with the process.
+        """
+        http = self.__get_thread_http()
+        streamed = isinstance(request.resumable, StreamMediaUpload)
+        resumable_by_next_run = not streamed
+        upload_session = self._upload_sessions.get(path, target) if resumable_by_next_run else None
+        file = None
+        if upload_session is not None:
+            logger.info('Resuming upload of {} from byte {}'.format(path, upload_session['offset']))
+            try:
+                file = self.__resume_upload(http, request, upload_session['uri'])
+            except HttpError as e:
+                if e.resp.status not in (404, 410):
+                    raise
+                logger.info('Upload session of {} has expired, starting over'.format(path))
+        while file is None:
+            progress = request.resumable_progress
+            status, file = request.next_chunk(http=http)
+            sent_bytes = (request.resumable.size() if file is not None else request.resumable_progress) - progress
+            # the streamed bytes are counted already, by the download response they're read from
+            METRICS.add(requests=1, bytes=0 if streamed else sent_bytes)
+            if file is None:
+                if resumable_by_next_run:
+                    self._upload_sessions.set(path, target, request.resumable_uri, request.resumable_progress)
+                logger.debug('Uploaded {} {}%'.format(path, int(status.progress() * 100)))
+        if resumable_by_next_run:
+            self._upload_sessions.remove(path)
+        return file
+
+    @staticmethod
+    def __resume_upload(http, request, upload_uri):
+        """
+        Asks the server for the offset of an interrupted upload it has acknowledged, see
+        https://developers.google.com/drive/api/guides/manage-uploads#resume-upload, and makes the following
+        next_chunk calls of the request continue the upload from there
+        :return: the uploaded file if the server has received the whole content already, None otherwise
+        :raises HttpError: 404 or 410 if the upload session has expired
+        """
+        response, content = http.request(upload_uri, method='PUT', body=b'', headers={
+            'Content-Length': '0', 'Content-Range': 'bytes */{}'.format(request.resumable.size())})
+        METRICS.add(requests=1)
+        if response.status in (200, 201):
+            return json.loads(content.decode('utf-8'))
+        if response.status != 308:
+            raise HttpError(response, content, uri=upload_uri)
+        acknowledged_range = response.get('range')  # 'bytes=0-<last byte>', missing if nothing has been received
+        request.resumable_uri = upload_uri
+        request.resumable_progress = int(acknowledged_range.split('-')[1]) + 1 if acknowledged_range else 0
+        return None
+
+    def __get_thread_http(self):
+        """httplib2.Http isn't thread-safe, so every thread sends its requests with its own authorized one"""
+        http = getattr(self._thread_local, 'http', None)
+        if http is None:
+            http = self._thread_local.http = self._credentials.authorize(httplib2.Http())
+        return http
+
+    def __get_root_folder_index(self):
+        """Lists the root folder once, the index is then kept up to date by send_files"""
+        if self._root_folder_index is None:
+            self._root_folder_index = DriveFolderIndex(self._root_folder.id, self.folder_index_file_path)
+            self._root_folder_index.load(self._service)
+        return self._root_folder_index
+
+    def __get_folder_indexes(self, file_paths, base_folder_path):
+        """
+        Finds the folder each file is sent to: the root folder, or in mirror mode the folder having the same path
+        relative to the root folder as the file's folder has relative to base_folder_path. The missing folders are
+        created, and the indexes of all the folders not listed yet are listed together with batch requests.
+        :return: dict of file path -> DriveFolderIndex of its folder
+        """
+        root_folder_index = self.__get_root_folder_index()
+        if not self.mirror_folders or base_folder_path is None:
+            return dict((path, root_folder_index) for path in file_paths)
+        folder_paths = {}
+        for path in file_paths:
+            folder_path = os.path.relpath(os.path.dirname(os.path.abspath(path)), os.path.abspath(base_folder_path))
+            if folder_path == os.curdir or folder_path.startswith(os.pardir):
+                folder_path = ''  # files outside of base_folder_path go to the root folder
+            folder_paths[path] = folder_path.replace(os.sep, '/')
+        if self._folder_tree is None:
+            self._folder_tree = DriveFolderTree(self._root_folder.id, self.folder_ids_file_path)
+        http = self.__get_thread_http()
+        created_folder_paths = self._folder_tree.ensure_folders(self._service, set(folder_paths.values()), http)
+        self._folder_indexes[self._root_folder.id] = root_folder_index
+        unlisted_indexes = []
+        for folder_path in set(folder_paths.values()):
+            folder_id = self._folder_tree.get(folder_path)
+            if folder_id not in self._folder_indexes:
+                self._folder_indexes[folder_id] = DriveFolderIndex(folder_id)
+                if folder_path not in created_folder_paths:  # new folders are known to be empty
+                    unlisted_indexes.append(self._folder_indexes[folder_id])
+        DriveFolderIndex.load_many(self._service, unlisted_indexes, http)
+        return dict((path, self._folder_indexes[self._folder_tree.get(folder_path)])
+                    for path, folder_path in folder_paths.items())
 
-    def send_files(self, file_paths):
+    def __send_file(self, path, folder_index, file_id=None, phases=None):
+        """
+        :param phases: metrics phases of the caller, when run by another thread
+        :return: True if the file has been sent
+        """
+        if phases is not None:
+            with METRICS.continue_phases(phases):
+                return self.__send_file(path, folder_index, file_id)
+        file_attrs = self.__extract_filename_ext_and_mimetype_from_path(path)
+        try:
+            start_time = time.time()
+            with METRICS.phase('drive_upload'):
+                file = self.__insert_file_into_folder(file_attrs[0], path, folder_index.folder_id, file_attrs[2],
+                                                      file_id)
+            folder_index.add(file)
+            elapsed_time = max(time.time() - start_time, 1e-6)
+            logger.success('File {} succesfully sent to Google Drive ({:.1f} KiB/s)'.format(
+                file_attrs[0], os.path.getsize(path) / 1024.0 / elapsed_time))
+            return True
+        except Exception as e:
+            logger.error('Error {} occurred while sending file: {} to Google Drive'.format(e, file_attrs[0]))
+            return False
+
+    def send_files(self, file_paths, workers=None, base_folder_path=None):
+        """
+        Uploads the files which aren't in their Drive folder yet.
+        :param workers: number of files uploaded concurrently, taken from config file if None
+        :param base_folder_path: folder whose layout is reproduced below the root folder in mirror mode
+                                 (gd_mirror_folders), the files are put flat into the root folder otherwise
+        :return: paths of the files which couldn't be sent
+        """
         if file_paths is None or len(file_paths) == 0:
             raise ValueError("Incorrect file paths argument format")
-        for path in file_paths:
-            if os.path.exists(path):
-                try:
-                    file_attrs = self.__extract_filename_ext_and_mimetype_from_path(path)
-                    if not self.__find_folder_or_file_by_name(file_attrs[0], self._root_folder.id):
-                        self.__insert_file_into_folder(file_attrs[0], path, self._root_folder.id, file_attrs[2])
-                        logger.success('File {} succesfully sent to Google Drive'.format(file_attrs[0]))
-                    else:
-                        logger.info('File {} already exists on Google Drive'.format(file_attrs[0]))
-                except Exception as e:
-                        logger.error('Error {} occurred while sending file: {} to Google Drive'.format(
-                            e, file_attrs[0])
-                        )
+        if workers is None:
+            workers = self.upload_workers
+        with METRICS.phase('drive_send'):
+            return self.__send_files(file_paths, workers, base_folder_path)
+
+    def send_file(self, file_path, base_folder_path=None):
+        """
+        Uploads a single file unless it's in its Drive folder already, see send_files. Many files can be sent at once
+        by calling it from many threads.
+        :return: True if the file is on Google Drive
+        """
+        with METRICS.phase('drive_send'):
+            with METRICS.phase('drive_metadata'), self._metadata_lock:
+                folder_indexes = self.__get_folder_indexes([file_path], base_folder_path)
+                uploads = self.__get_uploads([file_path], folder_indexes)
+            if not uploads:
+                return True
+            return self.__send_file(file_path, folder_indexes[file_path], uploads[0][1])
+
+    def send_stream(self, file_path, open_content, base_folder_path=None):
+        """
+        Uploads a content which isn't on disk, e.g. straight from its download, unless a file of the same name is in
+        its Drive folder already (whatever the sync_mode). Only the data not acknowledged by Google Drive yet is kept in
+        memory, i.e. an upload chunk at most. Many contents can be sent at once by calling it from many threads.
+        :param file_path: path the content would have on disk, giving its name and its folder in mirror mode
+        :param open_content: returns a context manager giving (iterator of the content chunks, content length), it's
+                             called only if the content needs to be sent
+        :return: True if the file is on Google Drive
+        """
+        file_name, _, file_mime_type = self.__extract_filename_ext_and_mimetype_from_path(file_path)
+        with METRICS.phase('drive_send'):
+            with METRICS.phase('drive_metadata'), self._metadata_lock:
+                folder_index = self.__get_folder_indexes([file_path], base_folder_path)[file_path]
+            if file_name in folder_index:
+                logger.info('File {} already exists on Google Drive'.format(file_name))
+                return True
+            try:
+                start_time = time.time()
+                with METRICS.phase('drive_upload'), open_content() as (chunks, size):
+                    media = StreamMediaUpload(chunks, size, file_mime_type or DEFAULT_MIME_TYPE,
+                                              self.upload_chunk_size)
+                    file = self.__insert_file_into_folder(file_name, file_path, folder_index.folder_id,
+                                                          file_mime_type, media=media)
+                folder_index.add(file)
+                elapsed_time = max(time.time() - start_time, 1e-6)
+                logger.success('File {} succesfully streamed to Google Drive ({:.1f} KiB/s)'.format(
+                    file_name, size / 1024.0 / elapsed_time))
+                return True
+            except Exception as e:
+                logger.error('Error {} occurred while streaming file: {} to Google Drive'.format(e, file_name))
+                return False
+
+    def __send_files(self, file_paths, workers, base_folder_path):
+        with METRICS.phase('drive_metadata'):
+            folder_indexes = self.__get_folder_indexes([path for path in file_paths if os.path.exists(path)],
+                                                       base_folder_path)
+            uploads = self.__get_uploads(file_paths, folder_indexes)
+        if workers <= 1 or len(uploads) <= 1:
+            return [path for path, file_id in uploads if not self.__send_file(path, folder_indexes[path], file_id)]
+        phases = METRICS.current_phases()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = dict((executor.submit(self.__send_file, path, folder_indexes[path], file_id, phases), path)
+                           for path, file_id in uploads)
+            return [futures[future] for future in as_completed(futures) if not future.result()]
+
+    def __get_uploads(self, file_paths, folder_indexes):
+        """
+        Picks the files which need to be sent, depending on sync_mode:
+          'name'    - the files missing from their folder by name
+          'content' - the files whose content (MD5 checksum and size) isn't in their folder under any name, files
+                      with the same name and different content are updated
+        :param folder_indexes: dict of file path -> DriveFolderIndex of its folder
+        :return: list of (path, id of the Drive file to update or None)
+        """
+        hash_manifest = HashManifest(self.hash_manifest_file_path) if self.sync_mode == 'content' else None
+        uploads = []
+        upload_file_names = set()
+        upload_contents = set()
+        try:
+            for path in file_paths:
+                if not os.path.exists(path):
+                    continue
+                file_name = self.__extract_filename_ext_and_mimetype_from_path(path)[0]
+                folder_index = folder_indexes[path]
+                if (folder_index.folder_id, file_name) in upload_file_names:
+                    continue
+                file_id = None
+                if hash_manifest is None:
+                    if file_name in folder_index:
+                        logger.info('File {} already exists on Google Drive'.format(file_name))
+                        continue
+                else:
+                    content = (hash_manifest.md5(path), os.path.getsize(path))
+                    same_content_file_name = folder_index.find_by_content(*content)
+                    if same_content_file_name is not None or (folder_index.folder_id, content) in upload_contents:
+                        logger.info('File {} already exists on Google Drive{}'.format(
+                            file_name, '' if same_content_file_name in (None, file_name) else
+                            ' as ' + same_content_file_name))
+                        continue
+                    if file_name in folder_index:
+                        logger.info('File {} has changed, updating it on Google Drive'.format(file_name))
+                        file_id = folder_index.get(file_name)['id']
+                    upload_contents.add((folder_index.folder_id, content))
+                uploads.append((path, file_id))
+                upload_file_names.add((folder_index.folder_id, file_name))
+        finally:
+            if hash_manifest is not None:
+                hash_manifest.save()
+        return uploads
 
     def download_file(self, file_name, file_id):
         request = self._service.files().get_media(fileId=file_id)
@@ -184,6 +494,241 @@ class GoogleDriveManager(object):
             logger.debug("Download %d%%." % int(status.progress() * 100))
 
 
+class DriveFolderIndex(object):
+    """
+    name -> {'id', 'size', 'md5Checksum'} index of the files within a Google Drive folder.
+    The folder is listed once, in pages of 1000 files with only the indexed fields, instead of querying every file
+    name separately; the index is then updated as the files get uploaded. If file_path is given, the index is also
+    stored there, and the following runs use it without listing the folder (remove the file to list it again).
+    """
+
+    def __init__(self, folder_id, file_path=None):
+        self.folder_id = folder_id
+        self.file_path = file_path
+        self._files = {}
+        self._file_names_by_content = {}
+        self._lock = threading.Lock()  # files may be added by many upload threads
+
+    def __contains__(self, name):
+        return name in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def get(self, name):
+        return self._files.get(name)
+
+    def find_by_content(self, md5_checksum, size):
+        """Returns the name of a file having the given MD5 checksum and size, None if there's no such file"""
+        name = self._file_names_by_content.get((md5_checksum, size))
+        entry = self._files.get(name)
+        if entry is None or (entry['md5Checksum'], entry['size']) != (md5_checksum, size):
+            return None  # the file has been updated with another content since
+        return name
+
+    def __set(self, name, entry):
+        self._files[name] = entry
+        if entry['md5Checksum'] is not None:
+            self._file_names_by_content[(entry['md5Checksum'], entry['size'])] = name
+
+    def load(self, service):
+        if self.__load_from_file():
+            logger.debug('Folder index of {} loaded from {}'.format(self.folder_id, self.file_path))
+            return
+        self._files = {}
+        self._file_names_by_content = {}
+        page_token = None
+        while True:
+            response = self.__list_request(service, page_token).execute()
+            METRICS.add(requests=1)
+            page_token = self.__add_listed_files(response)
+            if page_token is None:
+                break
+        logger.debug('Listed {} files in folder {}'.format(len(self._files), self.folder_id))
+        self.__save()
+
+    @staticmethod
+    def load_many(service, folder_indexes, http=None):
+        """Lists many folders at once, one page of each of them per batch request"""
+        pending = [(index, None) for index in folder_indexes]
+        while pending:
+            requests = [(str(position), index.__list_request(service, page_token))
+                        for position, (index, page_token) in enumerate(pending)]
+            responses = execute_batch(service, requests, http)
+            next_pending = []
+            for position, (index, page_token) in enumerate(pending):
+                page_token = index.__add_listed_files(responses[str(position)])
+                if page_token is not None:
+                    next_pending.append((index, page_token))
+            pending = next_pending
+
+    def __list_request(self, service, page_token=None):
+        return service.files().list(
+            q="'{}' in parents and trashed = false".format(escape_query_value(self.folder_id)),
+            spaces='drive',
+            fields='nextPageToken, files({})'.format(INDEXED_FILE_FIELDS),
+            pageSize=LIST_PAGE_SIZE,
+            pageToken=page_token
+        )
+
+    def __add_listed_files(self, response):
+        """Adds a page of files().list response, returns the token of the next page or None"""
+        for file in response.get('files', []):
+            if file['name'] not in self._files:
+                self.__set(file['name'], self.__entry(file))
+        return response.get('nextPageToken', None)
+
+    def add(self, file):
+        """Adds a file resource returned by the api (having at least INDEXED_FILE_FIELDS) to the index"""
+        with self._lock:
+            self.__set(file['name'], self.__entry(file))
+            self.__save()
+
+    @staticmethod
+    def __entry(file):
+        size = file.get('size')
+        return {'id': file['id'],
+                'size': int(size) if size is not None else None,
+                'md5Checksum': file.get('md5Checksum')}
+
+    def __load_from_file(self):
+        if self.file_path is None or not os.path.isfile(self.file_path):
+            return False
+        try:
+            with open(self.file_path) as f:
+                data = json.load(f)
+        except ValueError as e:
+            logger.warning("Cannot read folder index '{}': {}".format(self.file_path, e))
+            return False
+        if data.get('folder_id') != self.folder_id:
+            return False
+        for name, entry in data['files'].items():
+            self.__set(name, entry)
+        return True
+
+    def __save(self):
+        if self.file_path is not None:
+            with open(self.file_path, 'w') as f:
+                json.dump({'folder_id': self.folder_id, 'files': self._files}, f)
+
+
+class DriveFolderTree(object):
+    """
+    Ids of the folders below the root folder, keyed on their '/' separated paths relative to it.
+    The missing folders are looked up and then created level by level with batch requests, so a whole tree costs a
+    couple of requests per level instead of two per folder. The ids are kept in a json file and reused by the next
+    runs (remove the file if the folders have been changed outside of the script).
+    """
+
+    def __init__(self, root_folder_id, file_path):
+        self.root_folder_id = root_folder_id
+        self.file_path = file_path
+        self._ids = {}
+        if os.path.isfile(file_path):
+            try:
+                with open(file_path) as f:
+                    data = json.load(f)
+                if data.get('root_folder_id') == root_folder_id:
+                    self._ids = data['folders']
+            except ValueError as e:
+                logger.warning("Cannot read folder ids '{}': {}".format(file_path, e))
+
+    def get(self, folder_path):
+        return self.root_folder_id if folder_path == '' else self._ids.get(folder_path)
+
+    def ensure_folders(self, service, folder_paths, http=None):
+        """
+        Finds or creates the given folders together with their parents.
+        :return: set of paths of the created folders
+        """
+        missing_folder_paths = set()
+        for folder_path in folder_paths:
+            while folder_path and folder_path not in self._ids:
+                missing_folder_paths.add(folder_path)
+                folder_path = posixpath.dirname(folder_path)
+        created_folder_paths = set()
+        for depth in sorted(set(folder_path.count('/') for folder_path in missing_folder_paths)):
+            level = sorted(folder_path for folder_path in missing_folder_paths if folder_path.count('/') == depth)
+            responses = execute_batch(service, [(folder_path, self.__lookup_request(service, folder_path))
+                                                for folder_path in level], http)
+            for folder_path, response in responses.items():
+                if response.get('files'):
+                    self._ids[folder_path] = response['files'][0]['id']
+            responses = execute_batch(service, [(folder_path, self.__create_request(service, folder_path))
+                                                for folder_path in level if folder_path not in self._ids], http)
+            for folder_path, response in responses.items():
+                self._ids[folder_path] = response['id']
+                created_folder_paths.add(folder_path)
+                logger.success('Created Folder {} ID: {}'.format(folder_path, response['id']))
+        if missing_folder_paths:
+            with open(self.file_path, 'w') as f:
+                json.dump({'root_folder_id': self.root_folder_id, 'folders': self._ids}, f)
+        return created_folder_paths
+
+    def __lookup_request(self, service, folder_path):
+        return service.files().list(
+            q="name = '{}' and '{}' in parents and mimeType = '{}' and trashed = false".format(
+                escape_query_value(posixpath.basename(folder_path)),
+                escape_query_value(self.get(posixpath.dirname(folder_path))),
+                FOLDER_MIME_TYPE),
+            spaces='drive',
+            fields='files(id)',
+            pageSize=1
+        )
+
+    def __create_request(self, service, folder_path):
+        file_metadata = {
+            'name': posixpath.basename(folder_path),
+            'mimeType': FOLDER_MIME_TYPE,
+            'parents': [self.get(posixpath.dirname(folder_path))]
+        }
+        return service.files().create(body=file_metadata, fields='id')
+
+
+class StreamMediaUpload(MediaUpload):
+    """
+    Resumable upload of the content given by a chunk iterator, e.g. of a download response. The content before the
+    offset requested last can't be read again, so only the part not acknowledged by the server is buffered, i.e. at most
+    one upload chunk and one content chunk.
+    """
+
+    def __init__(self, chunks, size, mimetype, chunksize=DEFAULT_UPLOAD_CHUNK_SIZE):
+        self._chunks = iter(chunks)
+        self._size = size
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._buffer_offset = 0  # offset of the first buffered byte in the content
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        if begin < self._buffer_offset:
+            raise ValueError('Cannot upload the content from byte {}, it has been dropped up to byte {}'.format(
+                begin, self._buffer_offset))
+        while True:
+            dropped_length = min(begin - self._buffer_offset, len(self._buffer))
+            del self._buffer[:dropped_length]
+            self._buffer_offset += dropped_length
+            if self._buffer_offset == begin and len(self._buffer) >= length:
+                break
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer.extend(chunk)
+        return bytes(self._buffer[:length]) if self._buffer_offset == begin else b''
+
+
 class GoogleDriveFile(object):
     """Helper class that describes File or Folder stored on GoogleDrive server"""
     def __init__(self, file_name):
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import os
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+HASH_MANIFEST_FILE_NAME = '.gdrive_hash_manifest.json'
+HASH_READ_SIZE = 1024 * 1024
+
+
+class HashManifest(object):
+    """
+    MD5 checksums of local files, kept in a json file and keyed on the file path.
+    A stored checksum is reused as long as the modification time and the size of the file haven't changed, so the
+    files aren't hashed again on every run.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._entries = {}
+        self._changed = False
+        if os.path.isfile(file_path):
+            try:
+                with open(file_path) as f:
+                    self._entries = json.load(f)
+            except ValueError as e:
+                logger.warning("Cannot read hash manifest '{}': {}".format(file_path, e))
+
+    def md5(self, path):
+        """Returns the hex MD5 checksum of the file at path"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return entry['md5']
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_READ_SIZE), b''):
+                md5.update(block)
+        self._entries[path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'md5': md5.hexdigest()}
+        self._changed = True
+        return md5.hexdigest()
+
+    def save(self):
+        """Writes the manifest if any checksum has been computed, dropping the entries of removed files"""
+        if not self._changed:
+            return
+        self._entries = dict((path, entry) for path, entry in self._entries.items() if os.path.isfile(path))
+        with open(self.file_path, 'w') as f:
+            json.dump(self._entries, f)
+        self._changed = False
@@ -0,0 +1,117 @@
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER_BACKEND = 'lxml'
+except ImportError:  # lxml is optional, fall back to the pure python parser
+    HTML_PARSER_BACKEND = 'html.parser'
+
+RECAPTCHA_KEY_PATTERN = re.compile(r"Packt.offers.onLoadRecaptcha\('(.+?)'\)")
+
+
+def class_pattern(*class_names):
+    """
+    Matches a class attribute containing any of the given classes.
+    SoupStrainer sees the raw attribute value while parsing, so a plain class name wouldn't match `class="a b"`.
+    """
+    return re.compile(r'(^|\s)({})(\s|$)'.format('|'.join(re.escape(name) for name in class_names)))
+
+
+BOOK_DETAILS_CLASS_PATTERN = class_pattern(
+    'book-top-block-info-one-liner', 'book-top-block-info-authors', 'book-top-block-code')
+
+
+def is_book_details_element(name, attrs=None):
+    """Matches the book details divs and the publication date of a book page"""
+    if name == 'time':
+        return True
+    class_value = (attrs or {}).get('class') or ''
+    if isinstance(class_value, (list, tuple)):
+        class_value = ' '.join(class_value)
+    return name == 'div' and BOOK_DETAILS_CLASS_PATTERN.search(class_value) is not None
+
+
+class BookDetailsStrainer(SoupStrainer):
+    """
+    Keeps the elements matched by is_book_details_element. beautifulsoup4 < 4.13 calls a strainer function with the
+    name and the attributes of every tag, the later versions call it with the name only and ask allow_tag_creation.
+    """
+
+    def __init__(self):
+        SoupStrainer.__init__(self, is_book_details_element)
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return is_book_details_element(name, attrs)
+
+
+LOGIN_FORM_STRAINER = SoupStrainer(id='packt-user-login-form')
+FREE_LEARNING_STRAINER = SoupStrainer(attrs={'class': class_pattern(
+    'twelve-days-claim', 'free-ebook', 'dotd-title', 'dotd-main-book-image')})
+MY_BOOKS_STRAINER = SoupStrainer('div', attrs={'class': class_pattern('product-line')})
+BOOK_DETAILS_STRAINER = BookDetailsStrainer()
+
+
+def parse_html(markup, parse_only=None):
+    """Parses the markup with the fastest available backend, keeping only the elements matched by parse_only"""
+    return BeautifulSoup(markup, HTML_PARSER_BACKEND, parse_only=parse_only)
+
+
+def get_login_form_build_id(markup):
+    """Returns the form_build_id value of the login form"""
+    content = parse_html(markup, LOGIN_FORM_STRAINER)
+    form_build_id = [element['value'] for element in
+                     content.find(id='packt-user-login-form').find_all('input', {'name': 'form_build_id'})]
+    return form_build_id[0]
+
+
+def get_free_learning_data(markup):
+    """
+    Extracts the data needed to claim the daily ebook from the free-learning page.
+    :return: dict with the raw title, the captchaless claim url, the captcha form action, the reCaptcha website key
+             and the book page url; the url and the key entries are None when not present on the page
+    """
+    html = parse_html(markup, FREE_LEARNING_STRAINER)
+    claim_element = html.find(attrs={'class': 'twelve-days-claim'})
+    claim_form = html.select_one('.free-ebook form')
+    book_image = html.find('div', {'class': 'dotd-main-book-image'})
+    book_link = book_image.find('a') if book_image is not None else None
+    key_match = RECAPTCHA_KEY_PATTERN.search(markup)  # it's within a script, cheaper to search the raw markup
+    return {
+        'title': html.find('div', {'class': 'dotd-title'}).find('h2').next_element,
+        'claim_url': claim_element.get('href') if claim_element is not None else None,
+        'claim_form_url': claim_form['action'] if claim_form is not None else None,
+        'website_key': key_match.group(1) if key_match is not None else None,
+        'book_url': book_link.attrs['href'] if book_link is not None else None,
+    }
+
+
+def get_my_books_data(markup, download_formats):
+    """Returns a list of {'nid', 'title', 'download_urls'} dicts of all the books listed on my-ebooks page"""
+    book_data = []
+    my_books_html = parse_html(markup, MY_BOOKS_STRAINER)
+    for line in my_books_html.find_all('div', {'class': 'product-line'}):
+        if not line.get('nid'):
+            continue
+        title = line.find('div', {'class': 'title'}).getText().strip(' ').replace(' [eBook]', '')
+        download_urls = {}
+        for a in line.find_all('a'):
+            url = a.get('href')
+            for fm in download_formats:
+                if url.find(fm) != -1:
+                    download_urls[fm] = url
+        book_data.append({'nid': line.get('nid'), 'title': title, 'download_urls': download_urls})
+    return book_data
+
+
+def get_book_details(markup):
+    """Returns the description, author, publication date and code files path scraped from a book page"""
+    page = parse_html(markup, BOOK_DETAILS_STRAINER)
+    author = page.find('div', {'class': 'book-top-block-info-authors'})
+    return {
+        'description': page.find('div', {'class': 'book-top-block-info-one-liner'}).text.strip(),
+        'author': author.text.strip().split("\n")[0],
+        'date_published': page.find('time').text,
+        'code_files_url': page.find('div', {'class': 'book-top-block-code'}).find('a').attrs['href'],
+    }
@@ -0,0 +1,52 @@
+import json
+import sqlite3
+from contextlib import closing
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+LIBRARY_INDEX_FILE_NAME = '.packt_library.sqlite'
+
+
+class LibraryIndex(object):
+    """
+    Local SQLite copy of the titles, nids and download urls listed on the my-ebooks page, together with the
+    ETag/Last-Modified validators of the response it was built from, used to refresh it with conditional requests.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with closing(self.__connect()) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS books '
+                               '(nid TEXT PRIMARY KEY, title TEXT NOT NULL, download_urls TEXT NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def __connect(self):
+        return sqlite3.connect(self.file_path)
+
+    def get_validators(self):
+        """Returns the (etag, last_modified) pair of the last my-ebooks response, both might be None"""
+        with closing(self.__connect()) as connection:
+            meta = dict(connection.execute("SELECT key, value FROM meta WHERE key IN ('etag', 'last_modified')"))
+        return meta.get('etag'), meta.get('last_modified')
+
+    def get_books(self):
+        """Returns the indexed books as a list of {'nid', 'title', 'download_urls'} dicts"""
+        with closing(self.__connect()) as connection:
+            rows = connection.execute('SELECT nid, title, download_urls FROM books ORDER BY rowid').fetchall()
+        return [{'nid': nid, 'title': title, 'download_urls': json.loads(download_urls)}
+                for nid, title, download_urls in rows]
+
+    def update(self, books, etag=None, last_modified=None):
+        """Brings the index in line with the freshly parsed books, books gone from the library are dropped"""
+        with closing(self.__connect()) as connection, connection:
+            connection.executemany('INSERT OR REPLACE INTO books (nid, title, download_urls) VALUES (?, ?, ?)',
+                                   [(book['nid'], book['title'], json.dumps(book['download_urls']))
+                                    for book in books])
+            nids = set(book['nid'] for book in books)
+            stale_nids = [(nid,) for (nid,) in connection.execute('SELECT nid FROM books') if nid not in nids]
+            connection.executemany('DELETE FROM books WHERE nid = ?', stale_nids)
+            connection.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                   [('etag', etag), ('last_modified', last_modified)])
+        logger.debug("Library index '{}' updated with {} books".format(self.file_path, len(books)))
@@ -1,29 +1,71 @@
 #!/usr/bin/env python
 
+import atexit
+import json
 import logging
 import os
 import sys
+import threading
 
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:  # python 2, the handlers are called directly
+    QueueHandler = QueueListener = None
 
-def get_logger(module_name, log_folder_path=os.getcwd()):
-    """
-        module_name just to distinguish where the logs come from
-    """
+LOG_FILE_NAME = "LOG_FILE.log"
+JSON_LOG_FILE_NAME = "LOG_FILE.jsonl"
 
-    LOG_FILE_PATH = os.path.join(log_folder_path, "LOG_FILE.log")
+# adding a new logging level
+logging.SUCCESS = 19   # as ALL = 0, DEBUG = 10, INFO = 20, WARN = 30, ERROR = 40, FATAL = CRITICAL, CRITICAL = 50
+logging.addLevelName(logging.SUCCESS, 'SUCCESS')
+
+_lock = threading.Lock()
+_handler = None  # the single handler shared by all the loggers
+_listener = None
+_log_file_path = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats the records as json objects, one per line"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'name': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data)
 
-    # adding a new logging level
-    logging.SUCCESS = 19   # as ALL = 0, DEBUG = 10, INFO = 20, WARN = 30, ERROR = 40, FATAL = CRITICAL, CRITICAL = 50
-    logging.addLevelName(logging.SUCCESS, 'SUCCESS')
-    logger = logging.getLogger(module_name)
-    logger.success = lambda msg, *args: logger._log(logging.SUCCESS, msg, args)
 
+if QueueHandler is not None:
+    class _QueueHandler(QueueHandler):
+        """QueueHandler for a queue within the process, leaving the whole formatting to the listener thread"""
+
+        def prepare(self, record):
+            record.msg = record.getMessage()  # the args might be changed by the time the record is written
+            record.args = None
+            return record
+
+
+def _create_handlers(log_folder_path, json_lines):
     # create formatters
     console_log_formatter = logging.Formatter('[%(levelname)s] - %(message)s')
-    file_log_formatter = logging.Formatter('%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
+    if json_lines:
+        log_file_path = os.path.join(log_folder_path, JSON_LOG_FILE_NAME)
+        file_log_formatter = JsonLinesFormatter()
+    else:
+        log_file_path = os.path.join(log_folder_path, LOG_FILE_NAME)
+        file_log_formatter = logging.Formatter('%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
 
     # create file handler
-    file_handler = logging.FileHandler(LOG_FILE_PATH)
+    file_handler = logging.FileHandler(log_file_path)
     file_handler.setFormatter(file_log_formatter)
     file_handler.setLevel(logging.DEBUG)
 
@@ -31,13 +73,83 @@ def get_logger(module_name, log_folder_path=os.getcwd()):
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setFormatter(console_log_formatter)
     stream_handler.setLevel(logging.SUCCESS)
+    return log_file_path, file_handler, stream_handler
+
 
-    logger.setLevel(logging.SUCCESS)
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # writes out the queued records
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def configure_logging(log_folder_path=None, json_lines=False):
+    """
+    Sets up the file and console logging shared by all the loggers, (re)configuring it replaces the previous setup.
+    The file records are put into a queue and written by a background thread, so logging doesn't wait for the disk.
+    The console records are written right away, keeping their order with whatever is printed to stdout.
+    :param log_folder_path: folder of the log file, the current working directory if None
+    :param json_lines: if set, the log file has a json object per record and a .jsonl extension
+    """
+    global _handler, _listener, _log_file_path
+    with _lock:
+        log_file_path, file_handler, stream_handler = _create_handlers(log_folder_path or os.getcwd(), json_lines)
+        if _handler is None:
+            _handler = _MultiHandler()
+        if QueueListener is None:
+            _handler.set_handlers([file_handler, stream_handler])
+        else:
+            _stop_listener()
+            queue_handler = _QueueHandler(queue.Queue(-1))
+            _listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+            _listener.start()
+            _handler.set_handlers([queue_handler, stream_handler])
+        _log_file_path = log_file_path
+
+
+def get_log_file_path():
+    return _log_file_path
+
+
+class _MultiHandler(logging.Handler):
+    """Passes the records to many handlers, so the loggers keep the same handler when logging is reconfigured"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.handlers = []
+
+    def set_handlers(self, handlers):
+        for handler in self.handlers:
+            handler.close()
+        self.handlers = handlers
+
+    def emit(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def get_logger(module_name, log_folder_path=None):
+    """
+        module_name just to distinguish where the logs come from
+        Calling it many times with the same name returns the same logger, without adding any handler twice.
+    """
+    if _handler is None:
+        configure_logging(log_folder_path)
+    logger = logging.getLogger(module_name)
+    with _lock:
+        if _handler not in logger.handlers:
+            logger.success = lambda msg, *args: logger._log(logging.SUCCESS, msg, args)
+            logger.setLevel(logging.SUCCESS)
+            logger.addHandler(_handler)
     return logger
 
 
+atexit.register(_stop_listener)
+
+
 if __name__ == "__main__":
     logger = get_logger('_this is me')
     logger.debug('This is debug level')
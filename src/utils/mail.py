@@ -1,13 +1,20 @@
+import atexit
+import base64
 import os
 import configparser
 import smtplib
+import socket
+import tempfile
+import threading
+import uuid
 from os.path import basename
-from email.mime.application import MIMEApplication
+from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import COMMASPACE, formatdate
 
 from .logger import get_logger
+from .metrics import METRICS
 
 logger = get_logger(__name__)
 
@@ -15,12 +22,182 @@ logger = get_logger(__name__)
 COMMA = ", "
 DEFAULT_BODY = "Enjoy!"
 DEFAULT_SUBJECT = "New free packt ebook"
+DEFAULT_INFO_SUBJECT = "Info message from packtPublishingFreeEbook.py script"
+ATTACHMENT_READ_SIZE = 57 * 1024  # base64 encodes 57 bytes into a 76 characters long line
+SPOOL_MAX_SIZE = 1024 * 1024  # messages larger than that are spooled to a temporary file
+SEND_BUFFER_SIZE = 64 * 1024
+SMTP_TIMEOUT_SEC = 60  # a pooled connection dropped silently by the server raises instead of blocking forever
+
+
+def get_encoded_size(size):
+    """Returns the size of base64 encoded data of the given size, split into lines of 76 characters"""
+    encoded_size = (size + 2) // 3 * 4
+    return encoded_size + (encoded_size + 75) // 76 * 2
+
+
+def write_attachment_message(message_file, msg, file_path, file_name):
+    """
+    Writes msg with file_path attached to it into message_file, as CRLF separated lines.
+    The attachment is read and base64 encoded chunk by chunk, so it's never held in memory at once.
+    """
+    marker = uuid.uuid4().hex
+    part = MIMEBase('application', 'octet-stream', Name=file_name)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part['Content-Disposition'] = 'attachment; filename="{}"'.format(file_name)
+    part.set_payload(marker)
+    msg.attach(part)
+    head, tail = msg.as_string().split(marker)
+    message_file.write(head.replace('\n', '\r\n').encode('utf-8'))
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(ATTACHMENT_READ_SIZE), b''):
+            encoded = base64.b64encode(chunk)
+            message_file.write(b''.join(encoded[i:i + 76] + b'\r\n' for i in range(0, len(encoded), 76)))
+    message_file.write(tail.lstrip('\n').replace('\n', '\r\n').encode('utf-8'))
+
+
+def send_message_file(smtp, from_addr, to_addrs, message_file):
+    """
+    Same as smtplib.SMTP.sendmail, but the message (CRLF separated lines) is read from message_file and written to
+    the socket in chunks. The message size is announced first, so a server with a lower limit refuses it right away.
+    """
+    message_file.seek(0, os.SEEK_END)
+    size = message_file.tell()
+    message_file.seek(0)
+    refused_addrs = _start_mail_transaction(smtp, from_addr, to_addrs, size)
+    _send_message_data(smtp, message_file)
+    return refused_addrs
+
+
+def _start_mail_transaction(smtp, from_addr, to_addrs, size):
+    """Sends MAIL FROM and RCPT TO commands, returns the refused recipients like smtplib.SMTP.sendmail"""
+    smtp.ehlo_or_helo_if_needed()
+    size_limit = smtp.esmtp_features.get('size', '')
+    if size_limit.isdigit() and 0 < int(size_limit) < size:
+        raise smtplib.SMTPDataError(552, 'Message of {} bytes exceeds the server limit of {} bytes'.format(
+            size, size_limit))
+    code, response = smtp.mail(from_addr, ['SIZE={}'.format(size)] if smtp.has_extn('size') else [])
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, response, from_addr)
+    refused_addrs = {}
+    for addr in to_addrs:
+        code, response = smtp.rcpt(addr)
+        if code not in (250, 251):
+            refused_addrs[addr] = (code, response)
+    if len(refused_addrs) == len(to_addrs):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused_addrs)
+    return refused_addrs
+
+
+def _send_message_data(smtp, message_file):
+    """Sends DATA command followed by the dot-stuffed message_file content"""
+    smtp.putcmd('data')
+    code, response = smtp.getreply()
+    if code != 354:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, response)
+    buffer = []
+    buffer_size = 0
+    for line in message_file:
+        if line.startswith(b'.'):
+            line = b'.' + line  # dot-stuffing, see RFC 5321 4.5.2
+        buffer.append(line)
+        buffer_size += len(line)
+        if buffer_size >= SEND_BUFFER_SIZE:
+            smtp.send(b''.join(buffer))
+            buffer = []
+            buffer_size = 0
+    buffer.append(b'.\r\n')
+    smtp.send(b''.join(buffer))
+    code, response = smtp.getreply()
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+
+class PooledSMTPConnection(object):
+    """
+    Authenticated SMTP connection shared by all the messages sent through the same host, port and login during the
+    life of the process. It's opened on the first message, and opened again (once per message) when the server has
+    dropped it in the meantime.
+    """
+
+    def __init__(self, host, port, login, password, timeout=SMTP_TIMEOUT_SEC):
+        """:param timeout: seconds to wait for the connection and for every reply of the server"""
+        self._host = host
+        self._port = port
+        self._login = login
+        self._password = password
+        self._timeout = timeout
+        self._smtp = None
+        self._lock = threading.Lock()  # one message at a time over the connection
+
+    def __connect(self):
+        smtp = smtplib.SMTP(host=self._host, port=self._port, timeout=self._timeout)
+        try:
+            smtp.ehlo()
+            smtp.starttls()
+            smtp.ehlo()
+            smtp.login(self._login, self._password)
+        except Exception:
+            smtp.close()
+            raise
+        logger.debug('Connected to {}:{} as {}'.format(self._host, self._port, self._login))
+        return smtp
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """:param msg: the message string, or a binary file of it which is streamed to the server"""
+        with self._lock:
+            for attempt in range(2):
+                if self._smtp is None:
+                    self._smtp = self.__connect()
+                try:
+                    if hasattr(msg, 'read'):
+                        return send_message_file(self._smtp, from_addr, to_addrs, msg)
+                    return self._smtp.sendmail(from_addr, to_addrs, msg)
+                except (smtplib.SMTPServerDisconnected, socket.error) as e:
+                    self._smtp.close()
+                    self._smtp = None
+                    if attempt > 0:
+                        raise
+                    logger.debug('Connection to {} lost ({}), reconnecting...'.format(self._host, e))
+
+    def close(self):
+        with self._lock:
+            if self._smtp is not None:
+                try:
+                    self._smtp.quit()
+                except (smtplib.SMTPException, socket.error):
+                    self._smtp.close()
+                self._smtp = None
+
+
+_smtp_connections = {}
+_smtp_connections_lock = threading.Lock()
+
+
+def get_smtp_connection(host, port, login, password):
+    """Returns the connection shared by the process for the given host, port and login"""
+    with _smtp_connections_lock:
+        key = (host, port, login)
+        if key not in _smtp_connections:
+            _smtp_connections[key] = PooledSMTPConnection(host, port, login, password)
+        return _smtp_connections[key]
+
+
+@atexit.register
+def close_smtp_connections():
+    with _smtp_connections_lock:
+        for connection in _smtp_connections.values():
+            connection.close()
+        _smtp_connections.clear()
 
 
 class MailBook:
 
     def __init__(self, cfg_file_path):
-        defaults = {'from_email': None, 'to_emails': [], 'kindle_emails': []}
+        defaults = {'from_email': '', 'to_emails': '', 'kindle_emails': ''}  # python 3 accepts string values only
         config = configparser.ConfigParser(defaults=defaults)
         config.read(cfg_file_path)
         try:
@@ -30,59 +207,87 @@ class MailBook:
             self._send_from = config.get("MAIL", 'email')
             self._to_emails = list(filter(None, (config.get("MAIL", 'to_emails') or '').split(COMMA)))
             self._kindle_emails = list(filter(None, (config.get("MAIL", 'kindle_emails') or '').split(COMMA)))
+            max_attachment_size_mb = config.get("MAIL", 'max_attachment_size_mb', fallback=None)
+            self._max_attachment_size = None
+            if max_attachment_size_mb:
+                self._max_attachment_size = float(max_attachment_size_mb) * 1024 * 1024
         except configparser.NoSectionError:
             raise ValueError("ERROR: need at least one from and one or more to emails.")
 
     def _create_email_msg(self, to=None, subject=None, body=None):
-        self._to_emails = to or self._to_emails
-        if not self._to_emails:
+        to_emails = to or self._to_emails
+        if not to_emails:
             raise ValueError("ERROR: no email adress to send the message to was provided.")
 
         msg = MIMEMultipart()
         msg['From'] = self._send_from
-        msg['To'] = COMMASPACE.join(self._to_emails)
+        msg['To'] = COMMASPACE.join(to_emails)
         msg['Date'] = formatdate(localtime=True)
         msg['Subject'] = subject
         body = body if body else DEFAULT_BODY
         msg.attach(MIMEText(body))
         return msg
 
-    def _send_email(self, msg):
+    def _create_book_msg(self, book, to=None):
+        """
+        Builds the message with the book attached into a spooled temporary file, so the memory used stays bounded
+        whatever the size of the book.
+        :return: (message headers, binary file of the whole message)
+        """
+        if not os.path.isfile(book):
+            raise ValueError("ERROR: {} file doesn't exist.".format(book))
+        encoded_size = get_encoded_size(os.path.getsize(book))
+        if self._max_attachment_size is not None and encoded_size > self._max_attachment_size:
+            raise ValueError("ERROR: {} is too large to be sent, {:.1f} MB encoded while max_attachment_size_mb is "
+                             "{:.1f} MB.".format(book, encoded_size / 1024.0 ** 2,
+                                                 self._max_attachment_size / 1024.0 ** 2))
+        book_name = basename(book)
+        subject = "{}: {}".format(DEFAULT_SUBJECT, book_name)
+        msg = self._create_email_msg(to, subject=subject)
+        message_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        write_attachment_message(message_file, msg, book, book_name)
+        return msg, message_file
+
+    def _send_email(self, msg, message_file=None):
+        """
+        :param message_file: binary file of the whole message sent instead of msg, closed once sent
+        :return: True if the email has been sent
+        """
+        to_emails = msg['To'].split(COMMASPACE)
         try:
-            smtp = smtplib.SMTP(host=self._smtp_host, port=int(self._smtp_port))
-            smtp.ehlo()
-            smtp.starttls()
-            smtp.ehlo()
-            smtp.login(self._send_from, self._email_pass)
-            logger.info('Sending email from {} to {} ...'.format(self._send_from, ','.join(self._to_emails)))
-            smtp.sendmail(self._send_from, self._to_emails, msg.as_string())
-            logger.info('Email to {} has been succesfully sent'.format(','.join(self._to_emails)))
+            connection = get_smtp_connection(self._smtp_host, int(self._smtp_port), self._send_from, self._email_pass)
+            logger.info('Sending email from {} to {} ...'.format(self._send_from, ','.join(to_emails)))
+            if message_file is None:
+                message = msg.as_string()
+                size = len(message)
+            else:
+                message = message_file
+                message_file.seek(0, os.SEEK_END)
+                size = message_file.tell()
+            with METRICS.phase('smtp_send'):
+                connection.sendmail(self._send_from, to_emails, message)
+                METRICS.add(requests=1, bytes=size)
+            logger.info('Email to {} has been succesfully sent'.format(','.join(to_emails)))
+            return True
         except Exception as e:
             logger.error('Sending failed with an error: {}'.format(str(e)))
+            return False
         finally:
-            smtp.quit()
+            if message_file is not None:
+                message_file.close()
 
-    def send_info(self, subject="Info message from packtPublishingFreeEbook.py script", body=None):
+    def send_info(self, subject=DEFAULT_INFO_SUBJECT, body=None):
         msg = self._create_email_msg(subject=subject, body=body)
-        self._send_email(msg)
+        return self._send_email(msg)
 
     def send_book(self, book, to=None):
-        if not os.path.isfile(book):
-            raise ValueError("ERROR: {} file doesn't exist.".format(book))
-        book_name = basename(book)
-        subject = "{}: {}".format(DEFAULT_SUBJECT, book_name)
-        msg = self._create_email_msg(to, subject=subject)
-        with open(book, "rb") as f:
-            part = MIMEApplication(
-                f.read(),
-                Name=book_name
-            )
-            part['Content-Disposition'] = 'attachment; filename="{}"'.format(book_name)
-            msg.attach(part)
-        logger.info('Sending ebook: {} ...'.format(book_name))
-        self._send_email(msg)
+        """:return: True if the book has been sent"""
+        msg, message_file = self._create_book_msg(book, to)
+        logger.info('Sending ebook: {} ...'.format(basename(book)))
+        return self._send_email(msg, message_file)
 
     def send_kindle(self, book):
+        """:return: True if the book has been sent or there's no kindle email to send it to"""
         if not self._kindle_emails:
-            return
-        self.send_book(book, to=self._kindle_emails)
+            return True
+        return self.send_book(book, to=self._kindle_emails)
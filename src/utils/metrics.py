@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .fileutils import replace_file
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+METRICS_JSON_FILE_NAME = 'packt_metrics.json'
+METRICS_PROMETHEUS_FILE_NAME = 'packt_metrics.prom'
+PROMETHEUS_METRICS = (
+    # (name, type, help, phase field), all of them describe the last run only, hence gauges
+    ('packt_phase_runs', 'gauge', 'Number of times the phase has run', 'count'),
+    ('packt_phase_duration_seconds', 'gauge', 'Total time spent in the phase', 'duration_sec'),
+    ('packt_phase_requests', 'gauge', 'Number of network requests sent during the phase', 'requests'),
+    ('packt_phase_bytes', 'gauge', 'Number of bytes transferred during the phase', 'bytes'),
+    ('packt_phase_bytes_per_second', 'gauge', 'Bytes transferred per second spent in the phase', 'bytes_per_sec'),
+)
+
+
+class PhaseMetrics(object):
+    """
+    Durations, network requests and bytes transferred of the phases of a run (login, captcha, downloads, uploads...).
+    Phases nest: a request or bytes recorded by a thread count into every phase the thread is currently in, so e.g.
+    the 'run' phase has the totals of the whole run. Thread-safe, a work handed to another thread keeps counting into
+    the phases it was started in via continue_phases.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._phases = OrderedDict()
+        self._listeners = []
+
+    def __stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_phases(self):
+        """:return: names of the phases the calling thread is in, the outermost first"""
+        return tuple(self.__stack())
+
+    def add_listener(self, listener):
+        """
+        Makes listener.phase_entered(name) and listener.phase_exited(name) be called by the thread entering and
+        exiting every phase, e.g. to profile the phases
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    @contextmanager
+    def phase(self, name):
+        """Times the block as a run of the phase called name"""
+        stack = self.__stack()
+        stack.append(name)
+        for listener in self._listeners:
+            listener.phase_entered(name)
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            duration_sec = time.time() - start_time
+            for listener in reversed(self._listeners):
+                listener.phase_exited(name)
+            stack.pop()
+            self.record_run(name, duration_sec)
+
+    @contextmanager
+    def continue_phases(self, phases):
+        """Makes the block count into the given phases (as returned by current_phases), without timing them again"""
+        stack = self.__stack()
+        saved_stack = list(stack)
+        stack[:] = phases
+        try:
+            yield
+        finally:
+            stack[:] = saved_stack
+
+    def add(self, requests=0, bytes=0):
+        """Records requests and transferred bytes in all the phases the calling thread is in"""
+        stack = self.__stack()
+        if stack:
+            self.__add(stack, requests=requests, bytes=bytes)
+
+    def record_run(self, name, duration_sec, requests=0, bytes=0):
+        """Records a run of the phase timed by the caller, e.g. by a coroutine which can't use phase"""
+        self.__add((name,), count=1, duration_sec=duration_sec, requests=requests, bytes=bytes)
+
+    def record_response(self, response, *args, **kwargs):
+        """requests response hook, records the request together with its Content-Length bytes"""
+        try:
+            size = int(response.headers.get('Content-Length', 0))
+        except ValueError:
+            size = 0
+        self.add(requests=1, bytes=size)
+
+    def __add(self, names, **values):
+        with self._lock:
+            for name in names:
+                phase = self._phases.get(name)
+                if phase is None:
+                    phase = self._phases[name] = {'count': 0, 'duration_sec': 0.0, 'requests': 0, 'bytes': 0}
+                for key, value in values.items():
+                    phase[key] += value
+
+    def reset(self):
+        with self._lock:
+            self._phases.clear()
+
+    def to_dict(self):
+        """:return: phase name -> {'count', 'duration_sec', 'requests', 'bytes', 'bytes_per_sec'}"""
+        with self._lock:
+            phases = OrderedDict((name, dict(phase)) for name, phase in self._phases.items())
+        for phase in phases.values():
+            phase['bytes_per_sec'] = phase['bytes'] / phase['duration_sec'] if phase['duration_sec'] > 0 else 0.0
+        return phases
+
+    def write_json(self, file_path, success=None):
+        data = OrderedDict([('timestamp', time.time()), ('success', success), ('phases', self.to_dict())])
+        self.__write_file(file_path, json.dumps(data, indent=2))
+
+    def write_prometheus(self, file_path, success=None):
+        """Writes the metrics in the text format read by the textfile collector of node_exporter"""
+        phases = self.to_dict()
+        lines = []
+        for name, metric_type, help_text, field in PROMETHEUS_METRICS:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for phase_name, phase in phases.items():
+                lines.append('{}{{phase="{}"}} {}'.format(name, phase_name.replace('"', '\\"'), phase[field]))
+        lines.append('# HELP packt_run_timestamp_seconds Time the run has finished at')
+        lines.append('# TYPE packt_run_timestamp_seconds gauge')
+        lines.append('packt_run_timestamp_seconds {}'.format(time.time()))
+        if success is not None:
+            lines.append('# HELP packt_run_success Whether the run has finished without an error')
+            lines.append('# TYPE packt_run_success gauge')
+            lines.append('packt_run_success {}'.format(int(success)))
+        self.__write_file(file_path, '\n'.join(lines) + '\n')
+
+    @staticmethod
+    def __write_file(file_path, content):
+        """Writes a temporary file renamed afterwards, so the file is never read half written"""
+        temp_file_path = file_path + '.tmp'
+        with open(temp_file_path, 'w') as f:
+            f.write(content)
+        replace_file(temp_file_path, file_path)
+        logger.debug('Metrics written to {}'.format(file_path))
+
+
+# the metrics of the whole process, recorded by all the modules
+METRICS = PhaseMetrics()
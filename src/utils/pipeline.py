@@ -0,0 +1,111 @@
+import os
+import threading
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+from .logger import get_logger
+from .metrics import METRICS
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_PENDING_FILES = 4
+
+
+class SendPipeline(object):
+    """
+    Sends the files handed over by put as soon as they arrive, e.g. while other files are still being downloaded, and
+    deletes every file once its sink has confirmed it (unless told to keep them). put blocks while max_pending_files
+    files are waiting to be sent, so the files kept on disk at once are bounded by the number of producers +
+    max_pending_files + workers.
+
+        with SendPipeline(google_drive.send_file, workers=2) as pipeline:
+            ebook.download_books(titles, on_downloaded=pipeline.put)
+    """
+
+    def __init__(self, send_file, workers=1, max_pending_files=DEFAULT_MAX_PENDING_FILES, remove_sent_files=True):
+        """
+        :param send_file: called with the path of every file, returns False (or raises) if the file hasn't been sent,
+                          which keeps the file on disk; called by `workers` threads at once
+        :param remove_sent_files: deletes every file once it's sent, set it to False for files which are to be kept
+        """
+        self.send_file = send_file
+        self.remove_sent_files = remove_sent_files
+        self.sent_file_paths = []
+        self.failed_files = []  # (path, exception or None)
+        self._queue = queue.Queue(maxsize=max(max_pending_files, 1))
+        self._lock = threading.Lock()
+        self._handed_over = set()
+        self._phases = METRICS.current_phases()
+        self._threads = [threading.Thread(target=self.__run, name='packt-send-{}'.format(i))
+                         for i in range(max(workers, 1))]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(raise_errors=exc_type is None)
+
+    def put(self, file_path):
+        """Hands the file over to be sent, the same file is sent only once"""
+        with self._lock:
+            if file_path in self._handed_over:
+                return
+            self._handed_over.add(file_path)
+        self._queue.put(file_path)
+
+    def __run(self):
+        with METRICS.continue_phases(self._phases):
+            while True:
+                file_path = self._queue.get()
+                try:
+                    if file_path is None:
+                        return
+                    self.__send(file_path)
+                finally:
+                    self._queue.task_done()
+
+    def __send(self, file_path):
+        try:
+            with METRICS.phase('send_file'):
+                sent = self.send_file(file_path)
+        except Exception as e:
+            logger.error("Sending '{}' failed: {}".format(os.path.basename(file_path), e))
+            with self._lock:
+                self.failed_files.append((file_path, e))
+            return
+        if sent is False:
+            with self._lock:
+                self.failed_files.append((file_path, None))
+            return
+        if self.remove_sent_files:
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                logger.error("Removing sent '{}' failed: {}".format(os.path.basename(file_path), e))
+                with self._lock:
+                    self.failed_files.append((file_path, e))
+                return
+        with self._lock:
+            self.sent_file_paths.append(file_path)
+
+    def close(self, raise_errors=True):
+        """
+        Waits until all the handed over files are sent
+        :param raise_errors: re-raises the first error raised by send_file, once all the files have been handled
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.failed_files:
+            logger.warning("{} file(s) couldn't be sent or removed and have been kept: {}".format(
+                len(self.failed_files), ', '.join(os.path.basename(path) for path, _ in self.failed_files)))
+        errors = [error for _, error in self.failed_files if error is not None]
+        if raise_errors and errors:
+            raise errors[0]
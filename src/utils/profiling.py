@@ -0,0 +1,186 @@
+import cProfile
+import os
+import pstats
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_FILE_NAME = 'packt_profile_{}.pstats'
+COLLAPSED_STACKS_FILE_NAME = 'packt_profile_{}.collapsed'
+PROFILE_REPORT_FILE_NAME = 'packt_profile.txt'
+REPORT_TOP_FUNCTIONS = 20
+COLLAPSED_STACKS_MAX_DEPTH = 64
+COLLAPSED_STACKS_MIN_TIME_SEC = 1e-6  # call paths with less time get cut off
+
+
+class _PhaseProfile(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.count = 0
+        self.duration_sec = 0.0
+        self.memory_peak = 0
+        self.start_time = None
+
+
+class PhaseProfiler(object):
+    """
+    CPU profile (cProfile) and peak of traced memory allocations (tracemalloc, python 3 only) of every top-level phase
+    recorded by PhaseMetrics, e.g. session creation, grab, library, download, send, with the rest of the run going to
+    the 'run' phase. Phases nest, the time of a nested phase is profiled only in the nested one, so the profiles add
+    up to the whole run. Only the thread which has started the profiler is profiled, the work done by the download or
+    upload threads shows as time waiting for them.
+    """
+
+    def __init__(self, metrics, phases):
+        """
+        :param metrics: PhaseMetrics whose phases are profiled
+        :param phases: names of the profiled phases
+        """
+        self._metrics = metrics
+        self._profiles = OrderedDict((name, _PhaseProfile(name)) for name in phases)
+        self._stack = []
+        self._thread = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        self._thread = threading.current_thread()
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._metrics.add_listener(self)
+
+    def stop(self):
+        while self._stack:
+            self.phase_exited(self._stack[-1].name)
+        self._metrics.remove_listener(self)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __profiled_phase(self, name):
+        if threading.current_thread() is not self._thread:
+            return None
+        return self._profiles.get(name)
+
+    @staticmethod
+    def __memory_peak(reset=False):
+        if tracemalloc is None or not tracemalloc.is_tracing():
+            return 0
+        peak = tracemalloc.get_traced_memory()[1]
+        if reset and hasattr(tracemalloc, 'reset_peak'):  # python 3.9+, the peak of the whole run is kept otherwise
+            tracemalloc.reset_peak()
+        return peak
+
+    def phase_entered(self, name):
+        phase = self.__profiled_phase(name)
+        if phase is None:
+            return
+        if self._stack:
+            outer_phase = self._stack[-1]
+            outer_phase.profile.disable()
+            outer_phase.memory_peak = max(outer_phase.memory_peak, self.__memory_peak(reset=True))
+        else:
+            self.__memory_peak(reset=True)
+        self._stack.append(phase)
+        phase.count += 1
+        phase.start_time = time.time()
+        phase.profile.enable()
+
+    def phase_exited(self, name):
+        phase = self.__profiled_phase(name)
+        if phase is None or not self._stack or self._stack[-1] is not phase:
+            return
+        phase.profile.disable()
+        phase.duration_sec += time.time() - phase.start_time
+        phase.memory_peak = max(phase.memory_peak, self.__memory_peak())
+        self._stack.pop()
+        if self._stack:
+            outer_phase = self._stack[-1]
+            outer_phase.memory_peak = max(outer_phase.memory_peak, phase.memory_peak)
+            outer_phase.profile.enable()
+
+    def write(self, folder_path, collapsed_stacks=False):
+        """
+        Writes the pstats dump of every profiled phase (packt_profile_<phase>.pstats), a report with the top functions
+        and the memory peak of each phase (packt_profile.txt) and optionally the collapsed stacks of every phase
+        (packt_profile_<phase>.collapsed), which flamegraph.pl or speedscope turn into a flame graph.
+        """
+        report_file_path = os.path.join(folder_path, PROFILE_REPORT_FILE_NAME)
+        with open(report_file_path, 'w') as report:
+            for phase in self._profiles.values():
+                if not phase.count:
+                    continue
+                phase.profile.dump_stats(os.path.join(folder_path, PROFILE_FILE_NAME.format(phase.name)))
+                report.write('=== {}: {} run(s), {:.3f} s, traced memory peak {:.1f} KiB ===\n'.format(
+                    phase.name, phase.count, phase.duration_sec, phase.memory_peak / 1024.0))
+                stats = pstats.Stats(phase.profile, stream=report)
+                stats.sort_stats('cumulative').print_stats(REPORT_TOP_FUNCTIONS)
+                if collapsed_stacks:
+                    write_collapsed_stacks(stats, os.path.join(folder_path,
+                                                               COLLAPSED_STACKS_FILE_NAME.format(phase.name)))
+        logger.info('Profile written to {}'.format(report_file_path))
+
+
+def _function_label(func):
+    file_name, line, name = func
+    if file_name == '~':  # built-in
+        label = name
+    else:
+        label = '{}:{}:{}'.format(os.path.basename(file_name), name, line)
+    return label.replace(';', ',').replace(' ', '_')
+
+
+def _walk_stacks(stats, callees, stacks, func, stack, funcs, fraction):
+    """Adds the share of func's own time given by fraction to the stack leading to it, then walks its callees"""
+    total_time = stats.stats[func][2]
+    stack = stack + (_function_label(func),)
+    funcs = funcs | frozenset([func])
+    if total_time * fraction > 0:
+        stacks[';'.join(stack)] += total_time * fraction
+    if len(stack) >= COLLAPSED_STACKS_MAX_DEPTH:
+        return
+    for callee, edge_cumulative_time in callees[func]:
+        callee_cumulative_time = stats.stats[callee][3]
+        if callee in funcs or callee_cumulative_time <= 0:  # recursive calls are folded into the first one
+            continue
+        callee_fraction = fraction * min(edge_cumulative_time / callee_cumulative_time, 1.0)
+        if callee_cumulative_time * callee_fraction >= COLLAPSED_STACKS_MIN_TIME_SEC:
+            _walk_stacks(stats, callees, stacks, callee, stack, funcs, callee_fraction)
+
+
+def _collapse_stacks(stats):
+    """:return: "outer;inner;function" stack -> seconds spent in the function when called along that stack"""
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, caller_stats in callers.items():
+            callees[caller].append((func, caller_stats[3]))
+    stacks = defaultdict(float)
+    for func, func_stats in stats.stats.items():
+        if not func_stats[4]:  # called by nothing profiled
+            _walk_stacks(stats, callees, stacks, func, (), frozenset(), 1.0)
+    return stacks
+
+
+def write_collapsed_stacks(stats, file_path):
+    """
+    Writes the profile as collapsed stacks ("outer;inner;function microseconds" lines).
+    cProfile keeps only caller -> callee edges, not whole stacks, so the time of a function called from many places
+    is split between the call paths leading to it in proportion to the time spent under each caller.
+    """
+    stacks = _collapse_stacks(stats)
+    with open(file_path, 'w') as f:
+        for stack, time_sec in sorted(stacks.items()):
+            microseconds = int(round(time_sec * 1e6))
+            if microseconds:
+                f.write('{} {}\n'.format(stack, microseconds))
@@ -0,0 +1,49 @@
+import json
+import os
+import stat
+
+import requests
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+SESSION_CACHE_FILE_NAME = '.packt_session.json'
+COOKIE_ATTRIBUTES = ('name', 'value', 'domain', 'path', 'secure', 'expires')
+
+
+class SessionCache(object):
+    """
+    Stores the cookies of a logged in requests.Session on disk, so the next run can reuse them instead of logging in.
+    The cache file is readable and writable by its owner only as the cookies grant access to the account.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def save(self, session):
+        cookies = [dict((attr, getattr(cookie, attr)) for attr in COOKIE_ATTRIBUTES) for cookie in session.cookies]
+        fd = os.open(self.file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cookies, f)
+        os.chmod(self.file_path, stat.S_IRUSR | stat.S_IWUSR)  # the file might have existed with wider permissions
+        logger.debug("Session cookies stored in '{}'".format(self.file_path))
+
+    def load(self, session):
+        """Loads the stored cookies into the session, returns False if there's no usable cache"""
+        if not os.path.isfile(self.file_path):
+            return False
+        try:
+            with open(self.file_path) as f:
+                cookies = json.load(f)
+            for cookie in cookies:
+                session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("Cannot read session cache '{}': {}".format(self.file_path, e))
+            return False
+        return len(cookies) > 0
+
+    def clear(self):
+        """Removes the stored cookies, e.g. once they don't keep the session logged in anymore"""
+        if os.path.isfile(self.file_path):
+            os.remove(self.file_path)
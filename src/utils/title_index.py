@@ -0,0 +1,73 @@
+import bisect
+import difflib
+
+TITLE_MATCHING_MODES = ('exact', 'prefix', 'fuzzy')
+FUZZY_MATCH_CUTOFF = 0.8
+
+
+class BookTitleIndex(object):
+    """
+    Index of library books keyed on their normalized title, built once per library load.
+    Exact lookups compare normalized titles as before, 'prefix' and 'fuzzy' lookups are case insensitive and match
+    respectively every title starting with the requested one and the closest title (difflib ratio >= 0.8).
+    """
+
+    def __init__(self, book_data, normalize):
+        """
+        :param book_data: list of {'title', ...} dicts, each of them gets its normalized title under 'valid_title'
+        :param normalize: function converting a title into its normalized form
+        """
+        self._normalize = normalize
+        self._books = {}
+        self._positions = {}
+        for position, book in enumerate(book_data):
+            book['valid_title'] = normalize(book['title'])
+            self._books.setdefault(book['valid_title'], []).append(book)
+            self._positions[id(book)] = position
+        self._folded_titles = {}
+        for valid_title in self._books:
+            self._folded_titles.setdefault(valid_title.lower(), []).append(valid_title)
+        self._sorted_folded_titles = sorted(self._folded_titles)
+
+    def __len__(self):
+        return len(self._books)
+
+    def __contains__(self, title):
+        return self._normalize(title) in self._books
+
+    def __match(self, title, matching):
+        valid_title = self._normalize(title)
+        if valid_title in self._books or matching == 'exact':
+            return [valid_title] if valid_title in self._books else []
+        folded_title = valid_title.lower()
+        if matching == 'prefix':
+            start = bisect.bisect_left(self._sorted_folded_titles, folded_title)
+            matched_folded_titles = []
+            for folded in self._sorted_folded_titles[start:]:
+                if not folded.startswith(folded_title):
+                    break
+                matched_folded_titles.append(folded)
+        else:
+            matched_folded_titles = difflib.get_close_matches(folded_title, self._sorted_folded_titles, n=1,
+                                                              cutoff=FUZZY_MATCH_CUTOFF)
+        return [valid_title for folded in matched_folded_titles for valid_title in self._folded_titles[folded]]
+
+    def lookup(self, titles, matching='exact'):
+        """
+        Finds the books matching all the given titles in a single pass.
+        :param matching: one of TITLE_MATCHING_MODES
+        :return: (list of matched books in library order, list of titles which didn't match any book)
+        """
+        if matching not in TITLE_MATCHING_MODES:
+            raise ValueError("Incorrect matching arg. Allowed modes are: {}".format(', '.join(TITLE_MATCHING_MODES)))
+        matched_books = {}
+        unmatched_titles = []
+        for title in titles:
+            valid_titles = self.__match(title, matching)
+            if not valid_titles:
+                unmatched_titles.append(title)
+            for valid_title in valid_titles:
+                for book in self._books[valid_title]:
+                    matched_books[id(book)] = book
+        books = sorted(matched_books.values(), key=lambda book: self._positions[id(book)])
+        return books, unmatched_titles
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+UPLOAD_SESSIONS_FILE_NAME = '.gdrive_upload_sessions.json'
+
+
+class UploadSessionStore(object):
+    """
+    Resumable upload sessions (session uri and the last offset acknowledged by the server) of the unfinished uploads,
+    kept in a json file so an interrupted upload can be resumed by the next run.
+    A session is keyed on the file path and is only valid for the same target and the same file content (size and
+    modification time), otherwise it's dropped.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._sessions = {}
+        self._lock = threading.Lock()  # sessions are updated by many upload threads
+        if os.path.isfile(file_path):
+            try:
+                with open(file_path) as f:
+                    self._sessions = json.load(f)
+            except ValueError as e:
+                logger.warning("Cannot read upload sessions '{}': {}".format(file_path, e))
+
+    @staticmethod
+    def __file_state(path):
+        stat = os.stat(path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def get(self, path, target):
+        """:return: {'uri', 'offset', ...} of the unfinished upload of path to target, None if there isn't any"""
+        path = os.path.abspath(path)
+        with self._lock:
+            session = self._sessions.get(path)
+        if session is None:
+            return None
+        file_state = self.__file_state(path)
+        if session['target'] != target or any(session[key] != value for key, value in file_state.items()):
+            self.remove(path)
+            return None
+        return session
+
+    def set(self, path, target, uri, offset):
+        path = os.path.abspath(path)
+        session = dict(self.__file_state(path), target=target, uri=uri, offset=offset)
+        with self._lock:
+            self._sessions[path] = session
+            self.__save()
+
+    def remove(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._sessions.pop(path, None) is not None:
+                self.__save()
+
+    def __save(self):
+        with open(self.file_path, 'w') as f:
+            json.dump(self._sessions, f)